@@ -1,21 +1,64 @@
 from mesa import Agent
 
 class BaseAgent(Agent):
-    """Agent member of the iterated, spatial prisoner's dilemma model."""
+    """Agent member of the iterated, spatial prisoner's dilemma model.
 
-    def __init__(self, model):
+    Agents keep their own state in slots, and dead agents wait in the model's
+    agent_pool until spawn_agents() brings them back as new agents of the same class.
+    """
+
+    __slots__ = ("score",)
+
+    default_score = 1
+    counted_names = ()
+
+    def __init__(self, model, **traits):
         super().__init__(model)
         self.score = None
-        self.default_score = 1
+        self.set_traits(**traits)
+        self.model.counters.add(self)
+
+    @classmethod
+    def spawn_agents(cls, model, n, **traits):
+        """Create n agents with the same traits, reusing dead ones from the model's pool first.
+
+        Traits must be given in full, so that all agents share one counter key and tally.
+        """
+        pool = model.agent_pool[cls]
+        reused = min(n, len(pool))
+        for agent in pool[len(pool) - reused:]:
+            agent.revive(**traits)
+        if reused:
+            model.counters.add(pool[-1], sign=reused)
+            del pool[len(pool) - reused:]
+        if n > reused:
+            cls.create_agents(model, n - reused, **traits)
+
+    def revive(self, **traits):
+        """Bring a pooled agent back with the same identity and registration as a newly constructed one."""
+        self.unique_id = next(Agent._ids[self.model])
+        self.pos = None
+        self.score = None
+        self.model.register_agent(self)
+        self.set_traits(**traits)
+
+    def set_traits(self, **traits):
+        raise NotImplementedError(
+            "This method should be implemented in subclasses to set the agent genes and state."
+        )
 
     def step(self):
         if self.model.activation_order != "Simultaneous":
             self.advance()
 
     def advance(self):
-        payoff = self.get_payoff()
-        self.create_children(payoff)
-        self.die()
+        self.settle(self.get_payoff())
+
+    def settle(self, payoff):
+        """Act on the agent's payoff of this step."""
+        # Children are created for the whole population at once, by Model.reproduce
+        self.model.parents.append(self)
+        self.model.payoffs.append(payoff)
 
     def get_opponent(self):
         """Get the opponent of the agent."""
@@ -51,53 +94,90 @@ class BaseAgent(Agent):
             "This method should be implemented in subclasses to determine behaviour logic."
         )
 
-    def create_children(self, score):
-        """Create children based on the agent's score."""
-        while score >= 1:
-            self.create_child()
-            score -= 1
-        if self.random.random() < score:
-            self.create_child()
+    def genes(self):
+        """Traits passed on to the agent's children, as keyword arguments of spawn_agents()."""
+        raise NotImplementedError(
+            "This method should be implemented in subclasses to copy agent genes to children."
+        )
 
-    def create_child(self):
+    def counter_key(self):
+        """Key the model's population counters tally this agent under."""
         raise NotImplementedError(
-            "This method should be implemented in subclasses to copy agent genes to child."
+            "This method should be implemented in subclasses to group agents in the population counters."
         )
 
-    def die(self):
-        """Remove the agent from the model."""
+    def counted_in(self):
+        """Groups of the population counters that agents with this counter key belong to."""
+        return []
+
+    def counted_values(self):
+        """Values summed over the agent's groups in the population counters, named by counted_names."""
+        return ()
+
+    def die(self, tally=True):
+        """Remove the agent from the model, keeping it in the pool for reuse.
+
+        With tally=False the caller removes the agent from the population counters.
+        """
+        if tally:
+            self.model.counters.remove(self)
         self.model.deregister_agent(self)
+        self.model.agent_pool[type(self)].append(self)
 
 class SimpleAgent(BaseAgent):
     """An agent that cooperates or defects based on a fixed strategy."""
 
+    __slots__ = ("action",)
+
     def __init__(self, model, action=None):
-        super().__init__(model)
+        super().__init__(model, action=action)
+
+    def set_traits(self, action=None):
         if action is None:
-            self.action = self.random.choice(["C", "D"])
+            self.action = self.model.traits_random.choice(["C", "D"])
         else:
             self.action = action
 
+    def counter_key(self):
+        return self.action
+
+    def counted_in(self):
+        return ["cooperating" if self.action == "C" else "non_cooperating"]
+
     def get_actions(self, opponent):
         return self.action, opponent.action
 
-    def create_child(self):
-        """Create a new SimpleAgent with the same action."""
-        SimpleAgent(self.model, action=self.action)
+    def genes(self):
+        return {"action": self.action}
 
 class BeardAgent(BaseAgent):
     """An agent that may be altruistic toward beaded opponents."""
+
+    __slots__ = ("has_beard", "is_beard_altruistic")
+
     def __init__(self, model, has_beard=None, is_beard_altruistic=None):
-        super().__init__(model)
+        super().__init__(model, has_beard=has_beard, is_beard_altruistic=is_beard_altruistic)
+
+    def set_traits(self, has_beard=None, is_beard_altruistic=None):
         if has_beard is None:
-            self.has_beard = self.random.choice([True, False])
+            self.has_beard = self.model.traits_random.choice([True, False])
         else:
             self.has_beard = has_beard
         if is_beard_altruistic is None:
-            self.is_beard_altruistic = self.random.choice([True, False])
+            self.is_beard_altruistic = self.model.traits_random.choice([True, False])
         else:
             self.is_beard_altruistic = is_beard_altruistic
 
+    def counter_key(self):
+        return self.has_beard, self.is_beard_altruistic
+
+    def counted_in(self):
+        if self.has_beard:
+            kind = "true_beard" if self.is_beard_altruistic else "impostor"
+        else:
+            kind = "sucker" if self.is_beard_altruistic else "coward"
+        return ["cooperating" if self.is_beard_altruistic else "non_cooperating", kind]
+
     def get_actions(self, opponent):
         if self.is_beard_altruistic and opponent.has_beard:
             agent_action = "C"
@@ -110,37 +190,61 @@ class BeardAgent(BaseAgent):
 
         return agent_action, opponent_action
 
-    def create_child(self):
-        """Create a new BeardAgent with the same beard properties."""
-        BeardAgent(
-            self.model,
-            has_beard=self.has_beard,
-            is_beard_altruistic=self.is_beard_altruistic
-        )
+    def genes(self):
+        return {"has_beard": self.has_beard, "is_beard_altruistic": self.is_beard_altruistic}
 
 class ReputationAgent(BaseAgent):
     """An agent that uses their trust level and opponent's reputation to decide actions."""
+
+    __slots__ = ("trust", "reputation", "last_action")
+
+    default_score = {'trust': 0, 'reputation': 0}
+    counted_names = ("trust", "reputation")
+
     def __init__(self, model, trust=None, reputation=50):
-        super().__init__(model)
+        super().__init__(model, trust=trust, reputation=reputation)
+
+    def set_traits(self, trust=None, reputation=50):
         if reputation is None:
-            self.reputation = self.random.randint(0, 100)
+            self.reputation = self.model.traits_random.randint(0, 100)
         else:
             self.reputation = reputation
         
         if trust is None:
-            self.trust = self.random.randint(0, 100)
+            self.trust = self.model.traits_random.randint(0, 100)
         else:
             self.trust = trust
 
-        self.score = None
-        self.default_score = {'trust': 0, 'reputation': 0}
+        self.last_action = None
 
-    def advance(self):
-        reputation_changes = self.get_payoff()
-        self.apply_score(reputation_changes)
+    def counter_key(self):
+        # Groups only depend on which side of 50 the reputation is
+        return (self.reputation > 50) - (self.reputation < 50), self.last_action
+
+    def counted_in(self):
+        groups = ["reputation"]
+        if self.reputation < 50:
+            # Low reputation agents count as both cooperating and non-cooperating
+            groups += ["outcast", "cooperating", "non_cooperating"]
+        else:
+            groups.append("noble")
+        if self.reputation > 50:
+            groups.append("above_neutral")
+        if self.last_action == "C":
+            groups.append("cooperate_action")
+        elif self.last_action == "D":
+            groups.append("defect_action")
+        return groups
+
+    def counted_values(self):
+        return self.trust, self.reputation
+
+    def settle(self, payoff):
+        self.apply_score(payoff)
 
     def get_payoff_from_actions(self, my_action, opponent_action):
-        payoff = {'trust': 0, 'reputation': 0}
+        # The action is recorded along with the score, in a single counter update
+        payoff = {'trust': 0, 'reputation': 0, 'action': my_action}
         if my_action == "C":
             payoff['reputation'] = 1
         else:
@@ -163,15 +267,16 @@ class ReputationAgent(BaseAgent):
         else:
             opponent_action = "D"
 
-        self.last_action = agent_action
-        opponent.last_action = opponent_action
         return agent_action, opponent_action
 
     def apply_score(self, score):
-        """Apply the score to the agent's trust and reputation."""
+        """Apply the score to the agent's trust and reputation, and record the action it took if any."""
+        key, values = self.counter_key(), self.counted_values()
         self.trust += score['trust']
         self.reputation += score['reputation']
+        self.last_action = score.get('action', self.last_action)
 
         # Ensure trust and reputation stay within bounds
         self.trust = max(0, min(100, self.trust))
         self.reputation = max(0, min(100, self.reputation))
+        self.model.counters.change(self, key, values)
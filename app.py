@@ -8,9 +8,30 @@ from mesa.visualization import (
     make_plot_component,
     make_space_component,
 )
+from mesa.visualization.utils import force_update, update_counter
+from charts import chart_frame, downsampled_frame
+from histograms import TraitHistograms
+from meanfield import MeanFieldModel
 from model import Model
+from runner import BackgroundRunner
+from timings import StepTimings
 import solara
 import altair as alt
+import threading
+import time
+
+# Background runner of each model shown, stopped when the model is reset
+runners = {}
+
+# Most times a second the charts are re-rendered while a model steps in the background
+frames_per_second = 5
+
+# Most steps drawn in the heatmaps of the trait histograms, evenly spaced over the run
+histogram_steps = 200
+
+# Whether expected trajectories are hidden, drawn over the run, or drawn alone
+mean_field_modes = ["Off", "Overlay", "Only"]
+mean_field_mode = solara.reactive("Off")
 
 
 def pd_agent_portrayal(agent):
@@ -23,6 +44,171 @@ def pd_agent_portrayal(agent):
         "size": 25,
     }
 
+class DashboardModel(Model):
+    """Model created by the dashboard, which falls back to the Agents engine for stages the chosen engine does not support.
+
+    The reason is kept in error and shown on the page, instead of failing it.
+    """
+
+    def __init__(self, stage="Simple", engine="Agents", **params):
+        self.error = None
+        if stage not in self.engine_stages[engine]:
+            self.error = f"The {engine} engine does not support stage: {stage}, running it on the Agents engine instead."
+            engine = "Agents"
+        super().__init__(stage=stage, engine=engine, **params)
+
+
+@solara.component
+def ParameterErrors(model):
+    """Parameters of the model that could not be used as chosen."""
+    update_counter.get()
+    if model.error is not None:
+        solara.Error(label=model.error)
+
+
+def latest_metrics(model):
+    """Returns the latest snapshot of the metrics of a model stepped in the background, or its collector."""
+    runner = runners.get(model)
+    if runner is None:
+        return model.datacollector
+    # Between steps, the collector may be ahead of the runner's snapshot, after steps
+    # taken from the sidebar. A newer snapshot replaces the runner's, which it only
+    # replaces itself under the lock after a step, so renders never go back in time
+    if model.step_lock.acquire(blocking=False):
+        try:
+            collector = model.datacollector
+            if collector.offset + collector.rows > runner.snapshot.offset + runner.snapshot.rows:
+                runner.snapshot = collector.snapshot()
+        finally:
+            model.step_lock.release()
+    return runner.snapshot
+
+
+@solara.component
+def BackgroundControls(model):
+    """Play, pause and step a model on a worker thread, so that the page never waits on a step."""
+    update_counter.get()
+    runner = runners.get(model)
+    if runner is None:
+        runner = runners[model] = BackgroundRunner(model)
+
+    def start_rendering():
+        # Render the latest snapshot a few times a second, skipping the steps taken in between
+        def render():
+            rendered = runner.snapshot
+            while not runner.stopped:
+                time.sleep(1 / frames_per_second)
+                if runner.snapshot is not rendered:
+                    rendered = runner.snapshot
+                    force_update()
+            force_update()
+
+        threading.Thread(target=render, name="model-renderer", daemon=True).start()
+
+        def stop():
+            runner.stop()
+            runners.pop(model, None)
+
+        return stop
+
+    solara.use_effect(start_rendering, [model])
+
+    def play_pause():
+        if runner.playing:
+            runner.pause()
+        else:
+            runner.play()
+        force_update()
+
+    def set_steps_per_second(value):
+        runner.steps_per_second = value
+        force_update()
+
+    with solara.Card("Background Run"):
+        with solara.Row():
+            solara.Button(
+                label="❚❚" if runner.playing else "▶",
+                color="primary",
+                on_click=play_pause,
+                disabled=runner.stopped or not model.running,
+            )
+            solara.Button(
+                label="Step",
+                color="primary",
+                on_click=runner.step,
+                disabled=runner.playing or runner.stopped or not model.running,
+            )
+        solara.SliderInt(
+            label="Target Steps per Second (0 for no limit)",
+            value=runner.steps_per_second,
+            on_value=set_steps_per_second,
+            min=0,
+            max=60,
+        )
+        snapshot = latest_metrics(model)
+        steps = snapshot.steps()[-1] if snapshot.rows else 0
+        solara.Text(f"Step {steps}, last step took {runner.step_seconds * 1000:.1f} ms")
+        if runner.error is not None:
+            solara.Error(label=f"error in step: {runner.error}")
+
+
+@solara.component
+def MeanFieldPlot(model):
+    """Expected trajectories of the genotype stages, over the stochastic run or on their own."""
+    update_counter.get()
+    distribution = solara.use_reactive(model.params["distribution"])
+    child_cost = solara.use_reactive(model.params["child_cost"])
+    steps = solara.use_reactive(100)
+
+    with solara.Card("Mean-field Preview"):
+        solara.ToggleButtonsSingle(value=mean_field_mode, values=mean_field_modes)
+        if mean_field_mode.value == "Off":
+            return
+        if model.stage == "Reputation":
+            solara.Text("The mean-field preview only covers the Simple and Beard stages.")
+            return
+        columns = Model.stage_metrics[model.stage]
+
+        if mean_field_mode.value == "Only":
+            # Sliders of their own, so that the preview follows them without resetting the model
+            solara.SliderFloat("Cooperation Distribution", value=distribution, min=0.0, max=1.0, step=0.1)
+            solara.SliderFloat("Child Cost", value=child_cost, min=0.25, max=4, step=0.25)
+            solara.SliderInt("Steps", value=steps, min=10, max=1000, step=10)
+            preview = MeanFieldModel(**{
+                **{name: model.params[name] for name in ["initial_pop", "payoffs", "stage", "carrying_capacity"]},
+                "distribution": distribution.value,
+                "child_cost": child_cost.value,
+            })
+            expected = downsampled_frame(preview.trajectory(steps.value), columns)
+            chart = alt.Chart(expected).mark_line().encode(
+                x=alt.X("Step:Q", title="Step"),
+                y=alt.Y("Count:Q", title="Expected Population"),
+                color=alt.Color("Metric:N", title="Metric"),
+                tooltip=["Step", "Metric", "Count"]
+            )
+        else:
+            collector = latest_metrics(model)
+            expected = downsampled_frame(MeanFieldModel.like(model).trajectory(max(collector.steps()[-1], 1)), columns)
+            observed = chart_frame(collector, columns)
+            # Runs are solid lines, and their expected trajectories dashed lines of the same color
+            chart = alt.layer(
+                alt.Chart(observed).mark_line().encode(
+                    x=alt.X("Step:Q", title="Step"),
+                    y=alt.Y("Count:Q", title="Population"),
+                    color=alt.Color("Metric:N", title="Metric"),
+                    tooltip=["Step", "Metric", "Count"]
+                ),
+                alt.Chart(expected).mark_line(strokeDash=[4, 4]).encode(
+                    x="Step:Q",
+                    y="Count:Q",
+                    color="Metric:N",
+                    tooltip=["Step", "Metric", "Count"]
+                ),
+            )
+
+        solara.FigureAltair(chart.properties(width=600, height=300, title="Mean-field Trajectories"))
+
+
 def AltairLinePlotWrapper(model):
     @solara.component
     def AltairLinePlot():
@@ -30,24 +216,25 @@ def AltairLinePlotWrapper(model):
         import solara
         from solara.components.figure_altair import FigureAltair
 
-        df = model.datacollector.get_model_vars_dataframe()
-        df = df.reset_index()
-        if df.columns[0] != "Step":
-            df = df.rename(columns={df.columns[0]: "Step"})
+        # The mean-field preview replaces the run's charts in the stages it covers
+        if mean_field_mode.value == "Only" and model.stage != "Reputation":
+            return solara.Text("The run's charts are hidden while the mean-field preview replaces them.")
 
-        if df.empty or "All Agents" not in df.columns:
+        collector = latest_metrics(model)
+        values = collector.model_vars
+        if collector.rows == 0 or "All Agents" not in values:
             return solara.Text("Waiting for simulation data...")
 
-        all_zeros_col_reputation = (df["Average Reputation"] == 0).all()
-        all_zeros_col_impostors = (df["Impostors"] == 0).all()
+        all_zeros_col_reputation = not values["Average Reputation"].any()
+        all_zeros_col_impostors = not values["Impostors"].any()
 
         if not all_zeros_col_reputation:
             # Stage 4: Reputation and Trust Dynamics
 
             # Melt population metrics
-            population_df = df.melt(
-                id_vars=["Step"],
-                value_vars=["All Agents", "Noble Agents", "Outcast Agents"],
+            population_df = chart_frame(
+                collector,
+                ["All Agents", "Noble Agents", "Outcast Agents"],
                 var_name="Metric",
                 value_name="Count"
             )
@@ -59,9 +246,9 @@ def AltairLinePlotWrapper(model):
             ))
 
             # Melt reputation/trust metrics
-            reputation_df = df.melt(
-                id_vars=["Step"],
-                value_vars=["Average Reputation", "Average Trust", "Outcast Reputation", "Outcast Trust",
+            reputation_df = chart_frame(
+                collector,
+                ["Average Reputation", "Average Trust", "Outcast Reputation", "Outcast Trust",
                             "Noble Reputation", "Noble Trust"],
                 var_name="Metric",
                 value_name="Value"
@@ -79,10 +266,10 @@ def AltairLinePlotWrapper(model):
                 ]
             ))
 
-            if "Cooperate Actions" in df.columns and "Defect Actions" in df.columns:
-                actions_df = df.melt(
-                    id_vars=["Step"],
-                    value_vars=["Cooperate Actions", "Defect Actions"],
+            if "Cooperate Actions" in values and "Defect Actions" in values:
+                actions_df = chart_frame(
+                    collector,
+                    ["Cooperate Actions", "Defect Actions"],
                     var_name="Action",
                     value_name="Count"
                 )
@@ -140,16 +327,16 @@ def AltairLinePlotWrapper(model):
 
         elif not all_zeros_col_impostors:
             # Stage 2 & 3: Beard Dynamics
-            population_df = df.melt(
-                id_vars=["Step"],
-                value_vars=["All Agents", "Cooperating Agents"],
+            population_df = chart_frame(
+                collector,
+                ["All Agents", "Cooperating Agents"],
                 var_name="Metric",
                 value_name="Count"
             )
 
-            detailed_population_df = df.melt(
-                id_vars=["Step"],
-                value_vars=["Impostors", "Cowards", "True Beards", "Suckers"],
+            detailed_population_df = chart_frame(
+                collector,
+                ["Impostors", "Cowards", "True Beards", "Suckers"],
                 var_name="Metric",
                 value_name="Count"
             )
@@ -190,9 +377,9 @@ def AltairLinePlotWrapper(model):
                 domain=["All Agents", "Cooperating Agents", "Non-Cooperating Agents"],
                 range=["blue", "green", "red"]
             ))
-            population_df = df.melt(
-                id_vars=["Step"],
-                value_vars=["All Agents", "Cooperating Agents", "Non-Cooperating Agents"],
+            population_df = chart_frame(
+                collector,
+                ["All Agents", "Cooperating Agents", "Non-Cooperating Agents"],
                 var_name="Metric",
                 value_name="Count"
             )
@@ -213,6 +400,137 @@ def AltairLinePlotWrapper(model):
     return AltairLinePlot()
 
 
+def TimingsPlotWrapper(model):
+    @solara.component
+    def TimingsPlot():
+        import altair as alt
+        import solara
+        from solara.components.figure_altair import FigureAltair
+
+        if model.timings is None:
+            return solara.Text("Enable Record Step Timings to see where the time of a step goes.")
+
+        collector = latest_metrics(model)
+        # The first row is collected before any step
+        if collector.rows < 2:
+            return solara.Text("Waiting for simulation data...")
+
+        phases_df = chart_frame(
+            collector,
+            list(StepTimings.phases.values()),
+            var_name="Phase",
+            value_name="Seconds"
+        )
+        phases_chart = alt.Chart(phases_df).mark_area().encode(
+            x=alt.X("Step:Q", title="Step"),
+            y=alt.Y("Seconds:Q", title="Seconds", stack=True),
+            color=alt.Color("Phase:N", title="Phase"),
+            tooltip=["Step", "Phase", "Seconds"]
+        ).properties(
+            width=600,
+            height=300,
+            title="Time per Phase of a Step"
+        )
+
+        turnover_df = chart_frame(
+            collector,
+            ["All Agents", "Births", "Deaths", "Unplaced"],
+            var_name="Metric",
+            value_name="Count"
+        )
+        turnover_chart = alt.Chart(turnover_df).mark_line(point=True).encode(
+            x=alt.X("Step:Q", title="Step"),
+            y=alt.Y("Count:Q", title="Agents"),
+            color=alt.Color("Metric:N", title="Metric", scale=alt.Scale(
+                domain=["All Agents", "Births", "Deaths", "Unplaced"],
+                range=["blue", "green", "red", "orange"]
+            )),
+            tooltip=["Step", "Metric", "Count"]
+        ).properties(
+            width=600,
+            height=300,
+            title="Births and Deaths per Step"
+        )
+
+        summary = model.timings.summary()
+        with solara.Column():
+            FigureAltair(phases_chart)
+            FigureAltair(turnover_chart)
+            solara.Markdown(
+                f"Mean step: {summary['seconds_per_step'].sum() * 1000:.2f} ms, "
+                + ", ".join(f"{phase} {share:.0%}" for phase, share in summary["share"].items() if share)
+            )
+
+    return TimingsPlot()
+
+
+def HistogramPlotWrapper(model):
+    @solara.component
+    def HistogramPlot():
+        import altair as alt
+        import numpy as np
+        import pandas as pd
+        import solara
+        from solara.components.figure_altair import FigureAltair
+
+        if model.histograms is None:
+            return solara.Text("Enable Record Trait Histograms in the Reputation stage to see how trust and reputation spread.")
+
+        collector = latest_metrics(model)
+        if collector.rows == 0:
+            return solara.Text("Waiting for simulation data...")
+
+        values = collector.model_vars
+        edges = model.histograms.edges
+        bins = [f"{low:.0f}-{high:.0f}" for low, high in zip(edges[:-1], edges[1:])]
+        kept = np.unique(np.linspace(0, collector.rows - 1, min(collector.rows, histogram_steps)).astype(int))
+        steps = collector.steps()[kept]
+
+        charts = []
+        for trait in ["trust", "reputation"]:
+            counts = values[TraitHistograms.columns[trait]][kept]
+            trait_df = pd.DataFrame({
+                "Step": np.repeat(steps, len(bins)),
+                "Bin": np.tile(bins, len(steps)),
+                "Agents": counts.reshape(-1),
+            })
+            charts.append(alt.Chart(trait_df).mark_rect().encode(
+                x=alt.X("Step:O", title="Step", axis=alt.Axis(labelOverlap=True)),
+                y=alt.Y("Bin:O", title=trait.capitalize(), sort=bins[::-1]),
+                color=alt.Color("Agents:Q", title="Agents"),
+                tooltip=["Step", "Bin", "Agents"]
+            ).properties(
+                width=600,
+                height=200,
+                title=f"{trait.capitalize()} Distribution per Step"
+            ))
+
+        # Joint histogram of the latest step, rows of trust and columns of reputation
+        joint = values[TraitHistograms.columns["joint"]][-1]
+        joint_df = pd.DataFrame({
+            "Trust": np.repeat(bins, len(bins)),
+            "Reputation": np.tile(bins, len(bins)),
+            "Agents": joint.reshape(-1),
+        })
+        joint_chart = alt.Chart(joint_df).mark_rect().encode(
+            x=alt.X("Reputation:O", title="Reputation", sort=bins),
+            y=alt.Y("Trust:O", title="Trust", sort=bins[::-1]),
+            color=alt.Color("Agents:Q", title="Agents"),
+            tooltip=["Trust", "Reputation", "Agents"]
+        ).properties(
+            width=300,
+            height=300,
+            title=f"Trust against Reputation at Step {steps[-1]}"
+        )
+
+        with solara.Column():
+            for chart in charts:
+                FigureAltair(chart)
+            FigureAltair(joint_chart)
+
+    return HistogramPlot()
+
+
 
 # Model parameters
 model_params = {
@@ -241,6 +559,22 @@ model_params = {
         "values": Model.simulation_stages,
         "label": "Stage",
     },
+    "engine": {
+        "type": "Select",
+        "value": "Agents",
+        "values": Model.engines,
+        "label": "Engine",
+    },
+    "timings": {
+        "type": "Checkbox",
+        "value": False,
+        "label": "Record Step Timings",
+    },
+    "histograms": {
+        "type": "Checkbox",
+        "value": False,
+        "label": "Record Trait Histograms",
+    },
     "child_cost": Slider(
         "Child Cost",
         value=1,
@@ -259,14 +593,19 @@ plot_all = make_plot_component("All Agents")
 plot_component = make_plot_component("Cooperating Agents")
 
 # Initialize model
-initial_model = Model()
+initial_model = DashboardModel()
 
 
 # Create visualization with all components
 page = SolaraViz(
     model=initial_model,
     components=[
+        ParameterErrors,
+        BackgroundControls,
+        MeanFieldPlot,
         lambda model: AltairLinePlotWrapper(model),
+        lambda model: TimingsPlotWrapper(model),
+        lambda model: HistogramPlotWrapper(model),
     ],
     model_params=model_params,
     name="Greenbeards Simulations",
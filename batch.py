@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+from engines import CountEngine, GridEngine, NetworkEngine, ReputationEngine
+from metrics import MetricsCollector
+from model import Model, metrics_filename
+
+
+class BatchModel:
+    """Runs one replicate per seed of an engine backed Model, all advanced at once.
+
+    Replicates are the first dimension of the engine arrays. Replicate i draws from
+    numpy.random.default_rng(seeds[i]), the stream Model(seed=seeds[i]) hands to its
+    engine, so each replicate reproduces the single run with the same seed.
+    """
+
+    payoff = Model.payoff
+    reporters = Model.reporters
+
+    # Engines read the payoffs through the model, like they do with Model
+    get_payoff = Model.get_payoff
+
+    def __init__(
+        self, seeds, initial_pop=50, activation_order="Random", payoffs=None, distribution=0.5, stage="Simple", child_cost=1,
+        engine=None, carrying_capacity=None, stop_on_fixation=False, grid_size=50,
+        graph=None,
+    ):
+        self.seeds = list(seeds)
+        self.filenames = [
+            metrics_filename(seed, initial_pop, activation_order, payoffs, distribution, stage, child_cost)
+            for seed in self.seeds
+        ]
+        self.activation_order = activation_order
+        self.child_cost = child_cost
+        self.carrying_capacity = carrying_capacity
+        self.stop_on_fixation = stop_on_fixation
+
+        if payoffs is not None:
+            self.payoff = payoffs
+
+        # Default to the vectorized engine supporting the stage
+        if engine is None:
+            engine = "Arrays" if stage == "Reputation" else "Counts"
+
+        rngs = [np.random.default_rng(seed) for seed in self.seeds]
+        match engine:
+            case "Counts":
+                self.engine = CountEngine(self, initial_pop, stage, distribution, rngs)
+            case "Arrays":
+                self.engine = ReputationEngine(self, initial_pop, stage, distribution, rngs)
+            case "Grid":
+                self.engine = GridEngine(self, initial_pop, stage, distribution, rngs, size=grid_size)
+            case "Network":
+                self.engine = NetworkEngine(self, initial_pop, stage, distribution, rngs, graph=graph)
+            case _:
+                raise ValueError(f"Unknown batch engine: {engine}")
+
+        # Every metric holds one value per replicate at each step
+        self.steps = 0
+        self.datacollector = MetricsCollector(
+            {column: getattr(self.engine, reporter) for column, reporter in self.reporters.items()}
+        )
+        self.datacollector.collect(self)
+
+        # Replicates that stopped keep their last state, and only their rows
+        # up to the step they stopped at are reported
+        self.running = np.ones(len(self.seeds), dtype=bool)
+        self.lengths = np.ones(len(self.seeds), dtype=np.int64)
+        self.check_termination()
+
+    def check_termination(self):
+        """Stop the replicates whose outcome is decided, if asked to."""
+        if self.stop_on_fixation:
+            self.running &= ~self.engine.decided()
+
+    def step(self):
+        self.steps += 1
+        self.engine.step(self.running)
+        self.lengths[self.running] += 1
+        self.datacollector.collect(self)
+        self.check_termination()
+
+    def run(self, n):
+        """Run all replicates for n steps, or until none of them is running."""
+        for _ in range(n):
+            if not self.running.any():
+                break
+            self.step()
+
+    def get_model_vars_dataframes(self):
+        """Returns one DataFrame per seed, laid out like Model.datacollector's."""
+        values = self.datacollector.model_vars
+        return [
+            pd.DataFrame({column: steps[:length, replicate] for column, steps in values.items()})
+            for replicate, length in enumerate(self.lengths)
+        ]
+
+    def to_csv(self):
+        """Write the metrics of every seed to the file a single Model run would use."""
+        for filename, data in zip(self.filenames, self.get_model_vars_dataframes()):
+            if not data.empty:
+                data.to_csv(filename)
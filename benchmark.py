@@ -0,0 +1,151 @@
+"""
+Benchmarks of Model.step for every stage, activation regime and population size.
+
+Results are written as JSON, one file per run, and two of them can be compared
+to catch throughput regressions between commits:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json
+    python benchmark.py --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from model import Model
+
+
+def run_case(case, max_steps, budget):
+    """Time the steps of a single model, until max_steps or budget seconds are reached.
+
+    Populations are held at their initial size by a carrying capacity, so every
+    step of a case works on about the same number of agents.
+    """
+    start = time.perf_counter()
+    model = Model(seed=0, carrying_capacity=case["initial_pop"], timings=True, **case)
+    setup = time.perf_counter() - start
+
+    steps = 0
+    start = time.perf_counter()
+    while steps < max_steps and (steps == 0 or time.perf_counter() - start < budget):
+        model.step()
+        steps += 1
+    elapsed = time.perf_counter() - start
+
+    phases = model.timings.summary()["seconds_per_step"].to_dict()
+    phases["other"] = elapsed / steps - sum(phases.values())
+    return {
+        **case,
+        "agents": model.num_agents(),
+        "setup_seconds": setup,
+        "steps": steps,
+        "seconds_per_step": elapsed / steps,
+        "steps_per_second": steps / elapsed,
+        "phase_seconds_per_step": phases,
+        # Kilobytes on Linux, bytes on macOS
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024**2),
+    }
+
+
+def run_benchmarks(cases, max_steps=20, budget=2.0):
+    """Run every case in a fresh worker process, so that peak memory is measured per case."""
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+        for case in cases:
+            try:
+                yield executor.submit(run_case, case, max_steps, budget).result()
+            except ValueError as error:
+                # Engines only support some of the stages
+                print(f"Skipping {case}: {error}")
+
+
+def commit():
+    """Returns the current git commit of the repository, marked when there are uncommitted changes."""
+    repository = os.path.dirname(os.path.abspath(__file__))
+    try:
+        head = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=repository, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=repository, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{head}-dirty" if dirty else head
+
+
+def case_key(result):
+    return result["stage"], result["activation_order"], result["engine"], result["initial_pop"]
+
+
+def compare(before, after, threshold):
+    """Print the change in steps per second of every case found in both runs, returning the regressions."""
+    previous = {case_key(result): result for result in before["results"]}
+    print(f"Steps per second, {before.get('commit')} against {after.get('commit')}")
+    regressions = []
+    for result in after["results"]:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        ratio = result["steps_per_second"] / old["steps_per_second"]
+        flag = "REGRESSION" if ratio < 1 - threshold else ""
+        print(
+            f"{result['stage']:<24} {result['activation_order']:<12} {result['engine']:<8} {result['initial_pop']:>8} "
+            f"{old['steps_per_second']:>10.2f} {result['steps_per_second']:>10.2f} {ratio:>6.2f}x {flag}"
+        )
+        if flag:
+            regressions.append(result)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the greenbeards model.")
+    parser.add_argument("--stage", nargs="+", default=Model.simulation_stages, choices=Model.simulation_stages)
+    parser.add_argument("--activation-order", nargs="+", default=Model.activation_regimes, choices=Model.activation_regimes)
+    parser.add_argument("--engine", nargs="+", default=["Agents"], choices=Model.engines)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10**2, 10**3, 10**4, 10**5, 10**6])
+    parser.add_argument("--max-steps", type=int, default=20)
+    parser.add_argument("--budget", type=float, default=2.0, help="seconds of stepping per case, at least one step is run")
+    parser.add_argument("--output", default=None, help="JSON file of the results, benchmark-<commit>.json by default")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown reported as a regression when comparing")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            regressions = compare(json.load(before), json.load(after), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    cases = [
+        {"stage": stage, "activation_order": activation_order, "engine": engine, "initial_pop": size}
+        for engine in args.engine
+        for stage in args.stage
+        for activation_order in args.activation_order
+        for size in args.sizes
+    ]
+    results = []
+    for result in run_benchmarks(cases, args.max_steps, args.budget):
+        results.append(result)
+        print(
+            f"{result['stage']:<24} {result['activation_order']:<12} {result['engine']:<8} {result['initial_pop']:>8} "
+            f"{result['steps_per_second']:>10.2f} steps/s {result['peak_rss_mb']:>8.1f} MB"
+        )
+
+    version = commit()
+    output = args.output or f"benchmark-{version or 'unknown'}.json"
+    with open(output, "w") as file:
+        json.dump({
+            "commit": version,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "max_steps": args.max_steps,
+            "budget": args.budget,
+            "results": results,
+        }, file, indent=2)
+    print(f"Results written to {output}")
@@ -0,0 +1,106 @@
+"""
+Content addressed cache of finished runs, so that sweeps only compute missing points.
+"""
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+
+import networkx as nx
+import numpy as np
+
+import agents
+import counters
+import engines
+import histograms
+import metrics
+import model
+
+# Modules whose source decides the outcome of a run
+simulation_modules = [agents, counters, engines, histograms, metrics, model]
+
+
+def code_version():
+    """Returns a tag identifying the current source of the simulation modules."""
+    digest = hashlib.sha256()
+    for module in simulation_modules:
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()[:16]
+
+
+class RunCache:
+    """Stores the metric columns of runs, keyed by a hash of their parameters and step count.
+
+    Entries live in a directory per code version, so editing the model never
+    returns stale results, and collect_garbage() removes the other versions.
+    Runs without a seed are not reproducible and are never cached, nor are runs
+    given a networkx graph rather than a graph spec, recording step timings,
+    or streaming their metrics to disk.
+    """
+
+    def __init__(self, path="./cache", version=None):
+        self.path = path
+        self.version = version or code_version()
+
+    @staticmethod
+    def key(arguments, steps):
+        """Hash of every Model argument of a run and its step count."""
+        # Payoffs are keyed on tuples, which JSON objects cannot hold, so they are
+        # sorted items instead, the same whatever order the payoffs were given in
+        if arguments.get("payoffs") is not None:
+            arguments = {**arguments, "payoffs": sorted([*moves, payoff] for moves, payoff in arguments["payoffs"].items())}
+        text = json.dumps({"arguments": arguments, "steps": steps}, sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def filename(self, arguments, steps):
+        key = self.key(arguments, steps)
+        return os.path.join(self.path, self.version, key[:2], f"{key}.npz")
+
+    def cacheable(self, arguments):
+        # A graph object is only hashed by its repr, unlike a graph spec,
+        # timings are measured again on every run, and a cached run would not write its metrics
+        return (
+            arguments.get("seed") is not None
+            and not isinstance(arguments.get("graph"), nx.Graph)
+            and not arguments.get("timings")
+            and not arguments.get("metrics_path")
+        )
+
+    def __contains__(self, entry):
+        arguments, steps = entry
+        return self.cacheable(arguments) and os.path.exists(self.filename(arguments, steps))
+
+    def get(self, arguments, steps):
+        """Returns the cached metric columns of a run, or None if it has not been run."""
+        if (arguments, steps) not in self:
+            return None
+        with np.load(self.filename(arguments, steps)) as data:
+            return {column: data[column] for column in data.files}
+
+    def put(self, arguments, steps, metrics):
+        """Store the metric columns of a finished run."""
+        if not self.cacheable(arguments):
+            return
+        filename = self.filename(arguments, steps)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # Write to a temporary file first, so a crash never leaves a truncated entry
+        temporary = f"{filename}.{os.getpid()}.tmp.npz"
+        np.savez(temporary, **metrics)
+        os.replace(temporary, filename)
+
+    def collect_garbage(self):
+        """Remove the entries of every code version other than the current one."""
+        if not os.path.isdir(self.path):
+            return []
+        stale = [version for version in os.listdir(self.path) if version != self.version]
+        for version in stale:
+            shutil.rmtree(os.path.join(self.path, version))
+        return stale
+
+
+if __name__ == "__main__":
+    cache = RunCache(*sys.argv[1:2])
+    for version in cache.collect_garbage():
+        print(f"Removed runs of stale version {version}")
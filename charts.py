@@ -0,0 +1,125 @@
+"""
+Chart data for the dashboard, melted incrementally and downsampled to a fixed size.
+"""
+import weakref
+
+import numpy as np
+import pandas as pd
+
+
+def lttb(x, y, points):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling of a series.
+
+    The first and last points are always kept. Every other kept point is the one
+    of its bucket forming the largest triangle with the point kept before it and
+    the mean of the next bucket, which preserves the peaks and shape of the line.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    # Mean of each bucket, and the last point standing for the bucket after the last one
+    sizes = np.diff(edges)
+    mean_x = np.append(np.add.reduceat(x[:edges[-1]], edges[:-1]) / sizes, x[-1])
+    mean_y = np.append(np.add.reduceat(y[:edges[-1]], edges[:-1]) / sizes, y[-1])
+
+    kept = np.empty(points, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = mean_x[bucket + 1], mean_y[bucket + 1]
+        # Twice the area of the triangles, the factor does not change the largest one
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def downsampled_frame(values, columns, var_name="Metric", value_name="Count", points=500, steps=None):
+    """Returns metric columns melted to long format, each downsampled with LTTB to at most points rows.
+
+    steps is the step of every row, its index by default.
+    """
+    frames = []
+    for column in columns:
+        x = np.arange(len(values[column])) if steps is None else steps
+        kept = lttb(x, values[column], points)
+        frames.append(pd.DataFrame({
+            "Step": x[kept],
+            var_name: column,
+            value_name: values[column][kept],
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+class ChartSeries:
+    """Rows of some metrics of a MetricsCollector, melted to long format for a chart.
+
+    Rows collected since the previous update are melted and appended, as long as
+    each metric has at most points of them. Past that, each metric is downsampled
+    with LTTB to points rows, read straight from the collector's columns, so a
+    chart keeps the same size however long the run, or once the collector has
+    dropped rows. Updates may read from a MetricsSnapshot of the collector
+    instead, to render a model stepped elsewhere.
+    """
+
+    def __init__(self, collector, columns, var_name="Metric", value_name="Count", points=500):
+        self.collector = collector
+        self.columns = columns
+        self.var_name = var_name
+        self.value_name = value_name
+        self.points = points
+        self.rows = 0
+        self.frame = pd.DataFrame({"Step": [], var_name: [], value_name: []})
+
+    def update(self, source=None):
+        """Returns the rows of the chart, including those collected since the last update."""
+        if source is None:
+            source = self.collector
+        # Rows collected in total, counting those the collector dropped
+        rows = source.offset + source.rows
+        # A snapshot older than the rows already melted has nothing new
+        if rows <= self.rows:
+            return self.frame
+        values = source.model_vars
+        columns = [column for column in self.columns if column in values]
+
+        if rows <= self.points and source.offset == 0:
+            steps = np.arange(self.rows, rows) * source.every
+            new = pd.DataFrame({
+                "Step": np.tile(steps, len(columns)),
+                self.var_name: np.repeat(columns, len(steps)),
+                self.value_name: np.concatenate([values[column][self.rows:rows] for column in columns]),
+            })
+            self.frame = new if self.frame.empty else pd.concat([self.frame, new], ignore_index=True)
+        else:
+            self.frame = downsampled_frame(
+                values, columns, self.var_name, self.value_name, self.points, source.steps()
+            )
+        self.rows = rows
+        return self.frame
+
+
+# Series of each collector, dropped along with it when a new model is started
+chart_series = weakref.WeakKeyDictionary()
+
+
+def chart_frame(collector, columns, var_name="Metric", value_name="Count", points=500):
+    """Returns the melted and downsampled rows of some metrics, reusing the series kept for the collector.
+
+    Given a MetricsSnapshot, the series of the collector it was taken from is updated up to the snapshot.
+    """
+    source = collector
+    collector = getattr(source, "collector", source)
+    series = chart_series.setdefault(collector, {})
+    key = (tuple(columns), var_name, value_name, points)
+    if key not in series:
+        series[key] = ChartSeries(collector, columns, var_name, value_name, points)
+    return series[key].update(source)
@@ -0,0 +1,183 @@
+"""
+Checkpoints of a model in the middle of a run, to restore it or fork it into new runs.
+"""
+import inspect
+import itertools
+import json
+
+import networkx as nx
+import numpy as np
+from mesa import Agent
+
+from agents import SimpleAgent, BeardAgent, ReputationAgent
+from counters import PopulationCounters
+from model import Model
+
+agent_classes = [SimpleAgent, BeardAgent, ReputationAgent]
+
+# Parameters the saved state depends on, which a restored model must keep
+fixed_parameters = ["stage", "engine", "grid_size", "graph"]
+
+
+def save_checkpoint(model, path):
+    """Save the full state of a model between two steps to a compressed .npz file.
+
+    The file holds the model's parameters, step counter and random generator
+    states, the state of its agents or engine, and every metric collected so far.
+    """
+    params = dict(model.params)
+    arrays = {}
+    if params["payoffs"] is not None:
+        params["payoffs"] = [[*moves, payoff] for moves, payoff in params["payoffs"].items()]
+    if isinstance(params["graph"], nx.Graph):
+        # Graphs are saved as the adjacency the engine was built from
+        params["graph"] = None
+        arrays["graph/indptr"], arrays["graph/indices"] = model.engine.indptr, model.engine.indices
+
+    # Peek at the next unique id, then put it back
+    next_id = next(Agent._ids[model])
+    Agent._ids[model] = itertools.count(next_id)
+    meta = {
+        "params": params,
+        "steps": model.steps,
+        "running": model.running,
+        "next_id": next_id,
+        "random": model.random.getstate(),
+        "rng": model.rng.bit_generator.state,
+        "metrics_offset": model.datacollector.offset,
+        "metrics_calls": model.datacollector.calls,
+    }
+
+    if model.engine is None:
+        agents = list(model.agents)
+        classes = {type(agent) for agent in agents}
+        if len(classes) > 1:
+            raise ValueError("Only models with a single agent class can be saved")
+        if agents:
+            agent_class = classes.pop()
+            meta["agent_class"] = agent_class.__name__
+            arrays["agents/unique_id"] = np.array([agent.unique_id for agent in agents], dtype=np.int64)
+            for name in agent_class.__slots__:
+                values = [getattr(agent, name) for agent in agents]
+                # Actions not taken yet are saved as empty strings
+                arrays[f"agents/{name}"] = np.array(["" if value is None else value for value in values])
+    else:
+        for name in model.engine.state:
+            arrays[f"engine/{name}"] = getattr(model.engine, name)
+
+    if model.timings is not None:
+        meta["timings"] = {
+            "total_seconds": model.timings.total_seconds,
+            "total_births": model.timings.total_births,
+            "total_deaths": model.timings.total_deaths,
+            "total_unplaced": model.timings.total_unplaced,
+            "steps": model.timings.steps,
+        }
+
+    for name, values in model.datacollector.model_vars.items():
+        arrays[f"metrics/{name}"] = values
+    np.savez_compressed(path, meta=np.array(json.dumps(meta)), **arrays)
+
+
+def load_checkpoint(path, seed=None, **changes):
+    """Returns the model saved to a checkpoint, ready to take its next step.
+
+    Given a seed, the random generators are seeded with it instead of restored,
+    so the run continues differently. Other keyword arguments change parameters
+    of the model, such as child_cost or payoffs, from the next step on.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files}
+    meta = json.loads(str(arrays.pop("meta")))
+
+    params = meta["params"]
+    if params["payoffs"] is not None:
+        params["payoffs"] = {(mine, other): payoff for mine, other, payoff in params["payoffs"]}
+    if params["graph"] is not None:
+        params["graph"] = tuple(params["graph"])
+    elif "graph/indptr" in arrays:
+        params["graph"] = adjacency_graph(arrays["graph/indptr"], arrays["graph/indices"])
+    for name in changes:
+        if name in fixed_parameters:
+            raise ValueError(f"The {name} of a checkpoint cannot be changed")
+    params.update(changes)
+    if seed is not None:
+        params["seed"] = seed
+
+    # The saved state replaces the initial population, so none is created
+    model = Model(**{**params, "initial_pop": 0})
+    model.params = params
+    model.steps = meta["steps"]
+    model.running = meta["running"]
+
+    if model.engine is None:
+        if "agents/unique_id" in arrays:
+            load_agents(model, meta["agent_class"], arrays)
+    else:
+        for name in model.engine.state:
+            setattr(model.engine, name, arrays[f"engine/{name}"])
+    Agent._ids[model] = itertools.count(meta["next_id"])
+
+    if "timings" in meta and model.timings is not None:
+        model.timings.total_seconds.update(meta["timings"]["total_seconds"])
+        model.timings.total_births = meta["timings"]["total_births"]
+        model.timings.total_deaths = meta["timings"]["total_deaths"]
+        model.timings.total_unplaced = meta["timings"].get("total_unplaced", 0)
+        model.timings.steps = meta["timings"]["steps"]
+
+    model.datacollector.load(
+        {name.removeprefix("metrics/"): values for name, values in arrays.items() if name.startswith("metrics/")},
+        offset=meta.get("metrics_offset", 0),
+        calls=meta.get("metrics_calls"),
+    )
+
+    if seed is None:
+        version, state, gauss = meta["random"]
+        model.random.setstate((version, tuple(state), gauss))
+        model.rng.bit_generator.state = meta["rng"]
+    else:
+        # Reseeded in place, since engines hold on to the model's generator
+        model.random.seed(seed)
+        model.rng.bit_generator.state = np.random.default_rng(seed).bit_generator.state
+    return model
+
+
+def fork_checkpoint(path, seeds, **changes):
+    """Returns a model restored from a checkpoint for every seed, each with the same changes."""
+    return [load_checkpoint(path, seed=seed, **changes) for seed in seeds]
+
+
+def load_agents(model, class_name, arrays):
+    """Create the saved agents in their saved order, which decides how they are matched."""
+    agent_class = next(cls for cls in agent_classes if cls.__name__ == class_name)
+    columns = {}
+    for name in agent_class.__slots__:
+        values = arrays[f"agents/{name}"].tolist()
+        if arrays[f"agents/{name}"].dtype.kind == "U":
+            values = [value or None for value in values]
+        columns[name] = values
+
+    # Traits the agents are created with, the other slots are set afterwards
+    traits = inspect.signature(agent_class.set_traits).parameters
+    agents = agent_class.create_agents(
+        model, len(arrays["agents/unique_id"]), **{name: columns[name] for name in traits if name in columns}
+    )
+    for i, (agent, unique_id) in enumerate(zip(agents, arrays["agents/unique_id"].tolist())):
+        agent.unique_id = unique_id
+        for name, values in columns.items():
+            if name not in traits:
+                setattr(agent, name, values[i])
+
+    # Counters are rebuilt once every slot is set
+    model.counters = PopulationCounters()
+    for agent in model.agents:
+        model.counters.add(agent)
+
+
+def adjacency_graph(indptr, indices):
+    """Returns the graph of CSR adjacency arrays, with nodes numbered in order."""
+    graph = nx.Graph()
+    graph.add_nodes_from(range(len(indptr) - 1))
+    sources = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    graph.add_edges_from(zip(sources.tolist(), indices.tolist()))
+    return graph
@@ -0,0 +1,67 @@
+class PopulationCounters:
+    """Population metrics kept up to date as agents are born, change and die.
+
+    Agents are tallied under their counter_key(), which captures everything their
+    groups depend on, so an update touches a single tally. A tally holds the number
+    of agents under the key followed by the sum of each of their counted_values,
+    named by the agent class' counted_names. The groups of a key come from
+    counted_in() the first time the key is seen, and reporters add up the few
+    tallies belonging to a group.
+    An agent is removed before any counted attribute changes and added back after,
+    or moved at once with change().
+    """
+
+    def __init__(self):
+        self.tallies = {}
+        self.groups = {}
+        self.names = {}
+
+    def add(self, agent, sign=1):
+        """Tally the agent under its key, or sign agents with the same key and values."""
+        key = agent.counter_key()
+        tally = self.tallies.get(key)
+        if tally is None:
+            tally = self.tallies[key] = [0] * (1 + len(agent.counted_names))
+            self.groups[key] = agent.counted_in()
+            self.names[key] = agent.counted_names
+        tally[0] += sign
+        for i, value in enumerate(agent.counted_values(), 1):
+            tally[i] += sign * value
+
+    def remove(self, agent):
+        """Remove the agent from the tally of its key."""
+        self.add(agent, sign=-1)
+
+    def change(self, agent, key, values):
+        """Move the agent from the tally of key, where it was counted with values, to its current one.
+
+        If its key is unchanged, the sums of its tally are updated in place.
+        """
+        tally = self.tallies[key]
+        if agent.counter_key() == key:
+            for i, (value, old) in enumerate(zip(agent.counted_values(), values), 1):
+                tally[i] += value - old
+            return
+        tally[0] -= 1
+        for i, old in enumerate(values, 1):
+            tally[i] -= old
+        self.add(agent)
+
+    def num_keys(self):
+        """Returns the number of distinct keys with at least one agent tallied."""
+        return sum(1 for tally in self.tallies.values() if tally[0])
+
+    def total(self, group, name=None):
+        """Returns the number of agents in a group, or the sum of a counted value over it."""
+        total = 0
+        for key, tally in self.tallies.items():
+            if group in self.groups[key]:
+                total += tally[0] if name is None else tally[1 + self.names[key].index(name)]
+        return total
+
+    def mean(self, group, name):
+        """Returns the mean of a counted value over a group, or 0 if the group is empty."""
+        count = self.total(group)
+        if not count:
+            return 0
+        return self.total(group, name) / count
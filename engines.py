@@ -0,0 +1,606 @@
+import itertools
+from types import SimpleNamespace
+
+import networkx as nx
+import numpy as np
+
+from agents import SimpleAgent, BeardAgent
+
+
+def multivariate_hypergeometric(rng, colors, nsample):
+    """Draw nsample individuals without replacement from a population split by colors.
+
+    NumPy only samples populations below 10**9. Past that size the draw falls back
+    to a chain of conditional binomials, clipped so the sample is always feasible.
+    """
+    if colors.sum() < 10**9:
+        return rng.multivariate_hypergeometric(colors, nsample)
+
+    sample = np.zeros_like(colors)
+    remaining = int(colors.sum())
+    for i, n in enumerate(colors):
+        n = int(n)
+        remaining -= n
+        if nsample == 0:
+            break
+        drawn = rng.binomial(nsample, n / (n + remaining)) if n + remaining else 0
+        sample[i] = min(max(drawn, nsample - remaining), n)
+        nsample -= sample[i]
+    return sample
+
+
+# Graphs a network spec may name, called with the arguments following the name.
+# Random graphs use a fixed seed, so that every run of a spec shares the same network.
+graph_generators = {
+    "small-world": lambda n, k, p: nx.watts_strogatz_graph(n, k, p, seed=0),
+    "scale-free": lambda n, m: nx.barabasi_albert_graph(n, m, seed=0),
+    "lattice": lambda rows, columns: nx.grid_2d_graph(rows, columns, periodic=True),
+}
+
+
+def make_graph(graph):
+    """Returns the networkx graph given, or the one built from a spec such as ("small-world", n, k, p)."""
+    if isinstance(graph, nx.Graph):
+        return graph
+    kind, *arguments = graph
+    if kind not in graph_generators:
+        raise ValueError(f"Unknown graph: {kind}")
+    return graph_generators[kind](*arguments)
+
+
+def csr_adjacency(graph):
+    """Returns the indptr and indices arrays of an undirected graph's adjacency, nodes numbered in graph order.
+
+    The neighbours of node i are indices[indptr[i]:indptr[i + 1]]. Self loops are dropped.
+    """
+    index = {node: i for i, node in enumerate(graph)}
+    edges = np.fromiter(
+        map(index.__getitem__, itertools.chain.from_iterable(graph.edges())), dtype=np.int64
+    ).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    sources = np.concatenate([edges[:, 0], edges[:, 1]])
+    targets = np.concatenate([edges[:, 1], edges[:, 0]])
+    indptr = np.zeros(len(index) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(index)), out=indptr[1:])
+    return indptr, targets[np.argsort(sources, kind="stable")].astype(np.int32)
+
+
+class CountEngine:
+    """Well-mixed population stored as the number of agents per genotype.
+
+    Only valid for the stages where agents carry no state besides their genotype.
+    Pairing and reproduction are drawn from the same distributions as the agent
+    based model, so the cost of a step depends on the number of genotypes only.
+    The activation order has no effect on these stages and is ignored.
+
+    Counts hold one row per replicate, one replicate per random generator in rngs.
+    Reporters return one value per replicate.
+    """
+
+    name = "Counts"
+    # Attributes holding the state of the replicates, saved by checkpoints
+    state = ["counts"]
+
+    def __init__(self, model, initial_pop, stage, distribution, rngs=None):
+        self.model = model
+        self.rngs = [model.rng] if rngs is None else rngs
+
+        match stage:
+            case "Simple":
+                self.agent_class = SimpleAgent
+                self.genotypes = [{"action": "C"}, {"action": "D"}]
+                counts = [int(initial_pop*distribution), int(initial_pop*(1-distribution))]
+            case "Beards with one alele":
+                self.agent_class = BeardAgent
+                self.genotypes = self.beard_genotypes()
+                counts = [int(initial_pop*distribution), 0, 0, int(initial_pop*(1-distribution))]
+            case "Beards with two aleles":
+                self.agent_class = BeardAgent
+                self.genotypes = self.beard_genotypes()
+                counts = [int(initial_pop*0.25)] * 4
+            case _:
+                raise ValueError(f"The {self.name} engine does not support stage: {stage}")
+
+        self.counts = np.tile(np.array(counts, dtype=np.int64), (len(self.rngs), 1))
+        # Children born in each replicate at the latest step, before the carrying capacity culled any,
+        # and those drawn that were never born, which only happens on engines with space
+        self.born = np.zeros(len(self.rngs), dtype=np.int64)
+        self.unplaced = np.zeros(len(self.rngs), dtype=np.int64)
+        self.payoff = self.payoff_matrix()
+
+    @staticmethod
+    def beard_genotypes():
+        """All combinations of the beard and altruism alleles."""
+        return [
+            {"has_beard": True, "is_beard_altruistic": True},
+            {"has_beard": True, "is_beard_altruistic": False},
+            {"has_beard": False, "is_beard_altruistic": True},
+            {"has_beard": False, "is_beard_altruistic": False},
+        ]
+
+    def payoff_matrix(self):
+        """Payoff of genotype g when matched against genotype h, keyed as [g, h]."""
+        payoff = np.zeros((len(self.genotypes), len(self.genotypes)))
+        for g, genotype in enumerate(self.genotypes):
+            for h, opponent in enumerate(self.genotypes):
+                # Reuse the agents' behaviour logic, which only reads genotype attributes
+                my_action, opponent_action = self.agent_class.get_actions(
+                    SimpleNamespace(**genotype), SimpleNamespace(**opponent)
+                )
+                payoff[g, h] = self.model.get_payoff(my_action, opponent_action)
+        return payoff
+
+    def step(self, active=None):
+        """Advance every replicate, or only those selected by the active mask."""
+        for replicate, rng in enumerate(self.rngs):
+            if active is None or active[replicate]:
+                self.counts[replicate], self.born[replicate] = self.step_counts(rng, self.counts[replicate])
+
+    def decided(self):
+        """Returns whether each replicate went extinct or has a single genotype left."""
+        return np.count_nonzero(self.counts, axis=1) <= 1
+
+    def step_counts(self, rng, counts):
+        """Draw the genotype counts of the next generation of a single replicate, and the number born."""
+        counts = counts.copy()
+        offspring = np.zeros_like(counts)
+
+        # With an odd population, one agent is left without an opponent
+        # and receives the default score of a single child
+        if counts.sum() % 2:
+            loner = multivariate_hypergeometric(rng, counts, 1)
+            counts -= loner
+            offspring += loner
+
+        # Fill the first seat of every pair, then match the second seats against them
+        first = multivariate_hypergeometric(rng, counts, int(counts.sum()) // 2)
+        second = counts - first
+        pairs = np.zeros((len(counts), len(counts)), dtype=np.int64)
+        for g, n in enumerate(first):
+            pairs[g] = multivariate_hypergeometric(rng, second, int(n))
+            second -= pairs[g]
+
+        # Agents of genotype g that played against genotype h, from either seat
+        interactions = pairs + pairs.T
+        whole = np.floor(self.payoff)
+        children = (interactions * whole + rng.binomial(interactions, self.payoff - whole)).sum(axis=1)
+        if children.sum() >= 2**62:
+            raise OverflowError(
+                "Population is too large to be stored as genotype counts, consider a carrying capacity"
+            )
+        offspring += children.astype(np.int64)
+
+        # Offspring beyond the carrying capacity are culled at random
+        born = int(offspring.sum())
+        capacity = self.model.carrying_capacity
+        if capacity is not None and born > capacity:
+            offspring = multivariate_hypergeometric(rng, offspring, capacity)
+        return offspring, born
+
+    def count(self, **traits):
+        """Returns the number of agents whose genotype matches all the given traits."""
+        matches = [
+            all(genotype.get(trait) == value for trait, value in traits.items())
+            for genotype in self.genotypes
+        ]
+        return self.counts[:, matches].sum(axis=1)
+
+    def num_agents(self):
+        """Returns the number of agents in the model."""
+        return self.counts.sum(axis=1)
+
+    # Relevant for stage 1
+    def num_cooperating_agents(self):
+        """Returns the number of cooperating agents in the model based on stage."""
+        if self.agent_class is SimpleAgent:
+            return self.count(action="C")
+        return self.count(is_beard_altruistic=True)
+
+    def num_non_cooperating_agents(self):
+        """Returns the number of non-cooperating agents in the model based on stage."""
+        if self.agent_class is SimpleAgent:
+            return self.count(action="D")
+        return self.count(is_beard_altruistic=False)
+
+    # Relevant for stage 2 and 3
+    def num_impostors(self):
+        """Returns the number of impostor agents in the model."""
+        if self.agent_class is not BeardAgent:
+            return self.zero()
+        return self.count(has_beard=True, is_beard_altruistic=False)
+
+    def num_cowards(self):
+        """Returns the number of coward agents in the model."""
+        if self.agent_class is not BeardAgent:
+            return self.zero()
+        return self.count(has_beard=False, is_beard_altruistic=False)
+
+    def num_true_beards(self):
+        """Returns the number of true bearded agents in the model."""
+        if self.agent_class is not BeardAgent:
+            return self.zero()
+        return self.count(has_beard=True, is_beard_altruistic=True)
+
+    def num_suckers(self):
+        """Returns the number of sucker agents in the model."""
+        if self.agent_class is not BeardAgent:
+            return self.zero()
+        return self.count(has_beard=False, is_beard_altruistic=True)
+
+    # Stage 4 metrics never apply to genotype counts
+    def zero(self):
+        return np.zeros(len(self.counts), dtype=np.int64)
+
+    num_outcasts = num_nobles = avg_reputation = avg_trust = zero
+    count_cooperate_actions = count_defect_actions = zero
+    avg_trust_outcasts = avg_trust_nobles = avg_rep_outcasts = avg_rep_nobles = zero
+
+
+class GridEngine(CountEngine):
+    """Genotype stages on a toroidal grid of size x size cells, holding at most one agent each.
+
+    Agents are matched with one of their eight Moore neighbours, through a random
+    maximal matching, and unmatched agents get the default score. Children take
+    distinct cells at random among their parent's cell and its neighbours, and a
+    cell claimed by several children goes to one of them, the others are never born.
+    Children beyond the size of their parent's neighbourhood have no cell to claim
+    either. Both are counted in unplaced, reported with step timings. Generations
+    do not overlap, like in the agent based model.
+
+    Cells hold the index of their agent's genotype, or -1 when empty, one row per
+    replicate. Neighbours come from a table of cell indices built once, so a step
+    only works on arrays. Counts are kept up to date for the reporters.
+    """
+
+    name = "Grid"
+    state = ["counts", "cells"]
+
+    def __init__(self, model, initial_pop, stage, distribution, rngs=None, size=50):
+        super().__init__(model, initial_pop, stage, distribution, rngs)
+        self.neighbors = self.neighbor_table(size)
+        self.scatter(size * size)
+
+    def scatter(self, num_cells):
+        """Place the initial population of each replicate on random cells."""
+        if self.counts.sum(axis=1).max() > num_cells:
+            raise ValueError(f"An initial population of {self.counts.sum(axis=1).max()} does not fit on {num_cells} cells")
+        self.cells = np.full((len(self.rngs), num_cells), -1, dtype=np.int8)
+        for replicate, rng in enumerate(self.rngs):
+            genotypes = np.repeat(np.arange(len(self.genotypes)), self.counts[replicate])
+            self.cells[replicate, rng.permutation(num_cells)[:len(genotypes)]] = genotypes
+
+    @staticmethod
+    def neighbor_table(size):
+        """Indices of the eight Moore neighbours of every cell of a toroidal grid, cell x, y being x*size + y."""
+        x, y = np.divmod(np.arange(size * size), size)
+        offsets = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+        return np.stack(
+            [(x + dx) % size * size + (y + dy) % size for dx, dy in offsets], axis=1
+        ).astype(np.int32)
+
+    def step(self, active=None):
+        """Advance every replicate, or only those selected by the active mask."""
+        for replicate, rng in enumerate(self.rngs):
+            if active is None or active[replicate]:
+                self.cells[replicate], self.born[replicate], self.unplaced[replicate] = self.step_cells(
+                    rng, self.cells[replicate]
+                )
+                occupied = self.cells[replicate][self.cells[replicate] >= 0]
+                self.counts[replicate] = np.bincount(occupied, minlength=len(self.genotypes))
+
+    @staticmethod
+    def claim(rng, targets, num_cells):
+        """Returns the positions of a single claim drawn at random for each distinct target cell."""
+        order = rng.permutation(len(targets))
+        # Claims are written in a random order, so the one left in a cell is a random one
+        claimant = np.empty(num_cells, dtype=np.int64)
+        claimant[targets[order]] = order
+        return order[claimant[targets[order]] == order]
+
+    def match(self, rng, cells):
+        """Returns the cell of each agent's opponent, or -1, for a random maximal matching of neighbours."""
+        opponent = np.full(len(cells), -1, dtype=np.int64)
+        free = cells >= 0
+        candidates = np.flatnonzero(free)
+        while True:
+            # Only unmatched agents with an unmatched neighbour can still be paired
+            candidates = candidates[free[candidates]]
+            candidates = candidates[free[self.neighbors[candidates]].any(axis=1)]
+            if not len(candidates):
+                return opponent
+
+            # Half of the candidates propose to a random neighbour among the other half
+            proposing = rng.random(len(candidates)) < 0.5
+            receiving = np.zeros(len(cells), dtype=bool)
+            receiving[candidates[~proposing]] = True
+            proposers = candidates[proposing]
+            neighbors = self.neighbors[proposers]
+            valid = receiving[neighbors]
+            choice = np.argmax(rng.random(valid.shape) * valid, axis=1)
+            has_choice = valid.any(axis=1)
+            proposers = proposers[has_choice]
+            targets = neighbors[has_choice, choice[has_choice]]
+
+            # Each target accepts one of its proposers at random
+            accepted = self.claim(rng, targets, len(cells))
+            opponent[proposers[accepted]] = targets[accepted]
+            opponent[targets[accepted]] = proposers[accepted]
+            free[proposers[accepted]] = False
+            free[targets[accepted]] = False
+
+    def place(self, rng, parents, children):
+        """Returns the cell each child claims and the position of its parent in parents.
+
+        Each parent's children claim the first cells of a random order of its neighbourhood.
+        """
+        neighborhood = np.column_stack([parents, self.neighbors[parents]])
+        order = np.argsort(rng.random(neighborhood.shape), axis=1)
+        wanted = np.arange(neighborhood.shape[1]) < children[:, None]
+        targets = np.take_along_axis(neighborhood, order, axis=1)[wanted]
+        return targets, np.repeat(np.arange(len(parents)), wanted.sum(axis=1))
+
+    def step_cells(self, rng, cells):
+        """Draw the grid of the next generation of a single replicate, the number born and the number unplaced."""
+        parents = np.flatnonzero(cells >= 0)
+        genotypes = cells[parents]
+        opponents = self.match(rng, cells)[parents]
+
+        payoffs = np.full(len(parents), float(self.agent_class.default_score))
+        matched = opponents >= 0
+        payoffs[matched] = self.payoff[genotypes[matched], cells[opponents[matched]]]
+        whole = np.floor(payoffs)
+        children = whole.astype(np.int64) + (rng.random(len(parents)) < payoffs - whole)
+
+        # A cell claimed by several children goes to one of them at random
+        targets, owners = self.place(rng, parents, children)
+        born = self.claim(rng, targets, len(cells))
+        cells = np.full_like(cells, -1)
+        cells[targets[born]] = genotypes[owners[born]]
+
+        # Children beyond the carrying capacity are culled at random
+        capacity = self.model.carrying_capacity
+        occupied = np.flatnonzero(cells >= 0)
+        if capacity is not None and len(occupied) > capacity:
+            cells[rng.choice(occupied, len(occupied) - capacity, replace=False)] = -1
+        # Children without a cell in their parent's neighbourhood, or that lost their cell to another child
+        return cells, len(occupied), int(children.sum()) - len(occupied)
+
+
+class MeanFieldEngine(CountEngine):
+    """Expected genotype counts of the well-mixed stages, in the limit of a large population.
+
+    Every agent meets each genotype with its frequency in the population, so the
+    expected children of a genotype are its count times its mean payoff, and the
+    carrying capacity scales every count down alike, as the random cull does on
+    average. Counts are floats and a step has no random draws. Effects of a finite
+    population, such as drift, fixation and the unmatched agent, are left out.
+    """
+
+    name = "Mean-field"
+
+    def __init__(self, model, initial_pop, stage, distribution):
+        super().__init__(model, initial_pop, stage, distribution, rngs=[None])
+        self.counts = self.counts.astype(np.float64)
+
+    def step(self, active=None):
+        self.counts = self.expected_counts(self.counts)
+
+    def expected_counts(self, counts):
+        """Expected counts of the next generation, one row per replicate."""
+        total = counts.sum(axis=1, keepdims=True)
+        frequencies = np.divide(counts, total, out=np.zeros_like(counts), where=total > 0)
+        offspring = counts * (frequencies @ self.payoff.T)
+
+        capacity = self.model.carrying_capacity
+        if capacity is not None:
+            total = offspring.sum(axis=1, keepdims=True)
+            offspring *= np.divide(capacity, total, out=np.ones_like(total), where=total > capacity)
+        return offspring
+
+    def trajectory(self, steps):
+        """Returns the counts of the current step and the next steps, one row per step."""
+        history = np.empty((steps + 1, len(self.genotypes)))
+        counts = self.counts
+        history[0] = counts[0]
+        for step in range(1, steps + 1):
+            counts = self.expected_counts(counts)
+            history[step] = counts[0]
+        return history
+
+
+class NetworkEngine(GridEngine):
+    """Genotype stages on the nodes of a graph, holding at most one agent each.
+
+    Same rules as GridEngine, with the graph's edges in place of Moore neighbours.
+    The graph is a networkx graph or a spec naming one of graph_generators, and is
+    converted once to CSR adjacency arrays. Matching and placement then work on
+    arrays of edges, whatever the degrees of the nodes.
+    """
+
+    name = "Network"
+    default_graph = ("small-world", 2500, 8, 0.1)
+
+    def __init__(self, model, initial_pop, stage, distribution, rngs=None, graph=None):
+        # Cells are the nodes of the graph rather than those of a grid
+        CountEngine.__init__(self, model, initial_pop, stage, distribution, rngs)
+        self.indptr, self.indices = csr_adjacency(make_graph(self.default_graph if graph is None else graph))
+        num_nodes = len(self.indptr) - 1
+        # Node at the other end of each entry of indices
+        self.sources = np.repeat(np.arange(num_nodes, dtype=np.int32), np.diff(self.indptr))
+        self.scatter(num_nodes)
+
+    def match(self, rng, cells):
+        """Returns the node of each agent's opponent, or -1, for a random maximal matching over the edges."""
+        opponent = np.full(len(cells), -1, dtype=np.int64)
+        free = cells >= 0
+        sources, targets = self.sources, self.indices
+        while True:
+            # Only edges between two unmatched agents can still pair them
+            open_edges = free[sources] & free[targets]
+            sources, targets = sources[open_edges], targets[open_edges]
+            if not len(sources):
+                return opponent
+
+            # Half of the agents propose along one of their edges to the other half
+            proposing = rng.random(len(cells)) < 0.5
+            offers = proposing[sources] & ~proposing[targets]
+            proposers, receivers = sources[offers], targets[offers]
+            picked = self.claim(rng, proposers, len(cells))
+            proposers, receivers = proposers[picked], receivers[picked]
+
+            # Each receiver accepts one of its proposers at random
+            accepted = self.claim(rng, receivers, len(cells))
+            opponent[proposers[accepted]] = receivers[accepted]
+            opponent[receivers[accepted]] = proposers[accepted]
+            free[proposers[accepted]] = False
+            free[receivers[accepted]] = False
+
+    def place(self, rng, parents, children):
+        """Returns the node each child claims and the position of its parent in parents.
+
+        Each parent's children claim the first nodes of a random order of its own node and neighbours.
+        """
+        starts = self.indptr[parents]
+        sizes = self.indptr[parents + 1] - starts + 1
+        owners = np.repeat(np.arange(len(parents)), sizes)
+        offsets = np.arange(len(owners)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+        # Offset 0 stands for the parent's own node, the others for its neighbours
+        nodes = parents[owners]
+        neighbor = offsets > 0
+        nodes[neighbor] = self.indices[(starts[owners] + offsets - 1)[neighbor]]
+
+        # Sorting on the owner plus a random fraction shuffles the nodes of each parent
+        order = np.argsort(owners + rng.random(len(owners)))
+        wanted = offsets < children[owners]
+        return nodes[order][wanted], owners[wanted]
+
+
+class ReputationEngine:
+    """Reputation stage stored as arrays of trust, reputation and last action.
+
+    Agents are paired with a single permutation and every interaction of a step
+    is resolved at once, with the same rules as ReputationAgent.
+    The activation order has no effect on this stage and is ignored.
+
+    Arrays hold one row per replicate, one replicate per random generator in rngs.
+    Reporters return one value per replicate.
+    """
+
+    # Codes stored in last_action
+    no_action, defect, cooperate = -1, 0, 1
+    # Attributes holding the state of the replicates, saved by checkpoints
+    state = ["trust", "reputation", "last_action"]
+
+    def __init__(self, model, initial_pop, stage, distribution, rngs=None):
+        if stage != "Reputation":
+            raise ValueError(f"The Arrays engine does not support stage: {stage}")
+        self.model = model
+        self.rngs = [model.rng] if rngs is None else rngs
+
+        # Same initial values as ReputationAgent: random trust, neutral reputation
+        self.trust = np.stack([
+            rng.integers(0, 100, size=initial_pop, endpoint=True).astype(np.int16)
+            for rng in self.rngs
+        ])
+        self.reputation = np.full_like(self.trust, 50)
+        self.last_action = np.full(self.trust.shape, self.no_action, dtype=np.int8)
+
+    def step(self, active=None):
+        """Advance every replicate. Reputation agents never go extinct, so all replicates stay active."""
+        replicates, population = self.trust.shape
+
+        # Pair consecutive agents of a random permutation, the odd one out sits this step out
+        order = np.stack([rng.permutation(population) for rng in self.rngs])
+        pairs = order[:, :population // 2 * 2].reshape(replicates, -1, 2)
+        agent, opponent = pairs[..., 0], pairs[..., 1]
+        replicate = np.arange(replicates)[:, None]
+
+        # Actions are decided on the values from before the interaction
+        agent_cooperates = self.trust[replicate, agent] > self.reputation[replicate, opponent]
+        opponent_cooperates = self.trust[replicate, opponent] > self.reputation[replicate, agent]
+        self.last_action[replicate, agent] = agent_cooperates
+        self.last_action[replicate, opponent] = opponent_cooperates
+
+        # Cooperating raises one's reputation and the opponent's trust, defecting lowers them
+        agent_change = 2 * agent_cooperates.astype(np.int16) - 1
+        opponent_change = 2 * opponent_cooperates.astype(np.int16) - 1
+        self.reputation[replicate, agent] += agent_change
+        self.reputation[replicate, opponent] += opponent_change
+        self.trust[replicate, agent] += opponent_change
+        self.trust[replicate, opponent] += agent_change
+
+        # Ensure trust and reputation stay within bounds
+        np.clip(self.trust, 0, 100, out=self.trust)
+        np.clip(self.reputation, 0, 100, out=self.reputation)
+
+    def decided(self):
+        """Returns whether each replicate went extinct, the only outcome decided in this stage."""
+        return np.full(len(self.rngs), self.trust.shape[1] == 0)
+
+    @staticmethod
+    def mean(values, where=None):
+        """Mean of the selected values of each replicate, or 0 when there are none."""
+        if where is None:
+            where = np.ones(values.shape, dtype=bool)
+        selected = np.count_nonzero(where, axis=1)
+        total = np.sum(values, axis=1, where=where, dtype=np.int64)
+        return np.divide(total, selected, out=np.zeros(len(values)), where=selected > 0)
+
+    def num_agents(self):
+        """Returns the number of agents in the model."""
+        return np.full(len(self.rngs), self.trust.shape[1])
+
+    # Reputation agents are counted by reputation, mirroring Model
+    def num_cooperating_agents(self):
+        """Returns the number of cooperating agents in the model based on stage."""
+        return np.count_nonzero(self.reputation < 50, axis=1)
+
+    def num_non_cooperating_agents(self):
+        """Returns the number of non-cooperating agents in the model based on stage."""
+        return np.count_nonzero(self.reputation < 50, axis=1)
+
+    # Stage 2 and 3 metrics never apply to reputation agents
+    def zero(self):
+        return np.zeros(len(self.rngs), dtype=np.int64)
+
+    num_impostors = num_cowards = num_true_beards = num_suckers = zero
+
+    # Relevant for stage 4
+    def num_outcasts(self):
+        """Returns the number of low reputation agents in the model."""
+        return np.count_nonzero(self.reputation < 50, axis=1)
+
+    def num_nobles(self):
+        """Returns the number of high reputation agents in the model."""
+        return np.count_nonzero(self.reputation >= 50, axis=1)
+
+    def avg_reputation(self):
+        """Returns the average reputation of agents in the model."""
+        return self.mean(self.reputation)
+
+    def avg_trust(self):
+        """Returns the average trust of agents in the model."""
+        return self.mean(self.trust)
+
+    def count_cooperate_actions(self):
+        return np.count_nonzero(self.last_action == self.cooperate, axis=1)
+
+    def count_defect_actions(self):
+        return np.count_nonzero(self.last_action == self.defect, axis=1)
+
+    def avg_trust_outcasts(self):
+        """Returns the average trust of low reputation agents in the model."""
+        return self.mean(self.trust, self.reputation < 50)
+
+    def avg_trust_nobles(self):
+        """Returns the average trust of high reputation agents in the model."""
+        return self.mean(self.trust, self.reputation > 50)
+
+    def avg_rep_outcasts(self):
+        """Returns the average reputation of low reputation agents in the model."""
+        return self.mean(self.reputation, self.reputation < 50)
+
+    def avg_rep_nobles(self):
+        """Returns the average reputation of high reputation agents in the model."""
+        return self.mean(self.reputation, self.reputation > 50)
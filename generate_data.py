@@ -1,5 +1,5 @@
 from model import Model
-from tqdm import tqdm
+from batch import BatchModel
 import os
 
 model_params = {
@@ -9,6 +9,7 @@ model_params = {
     "stage": "Simple",
     "child_cost": 1,
 }
+seeds = range(100)
 
 if not os.path.exists(f"data"):
     os.mkdir(f"data")
@@ -16,46 +17,31 @@ for stage in Model.simulation_stages:
     if not os.path.exists(f"data/{stage}"):
         os.mkdir(f"data/{stage}")
 
+# Every seed of a stage is run as one replicate of a single batch
 print("Generating data for stage 1 agents")
-for seed in tqdm(range(100)):
-    model_params["seed"] = seed
-    model_params["stage"] = "Simple"
-    model_params["child_cost"] = 1
-    model = Model(**model_params)
-    model.run(20)
-    data = model.datacollector.get_model_vars_dataframe()
-    if not data.empty:
-        data.to_csv(model.filename)
+model_params["stage"] = "Simple"
+model_params["child_cost"] = 1
+batch = BatchModel(seeds, **model_params)
+batch.run(20)
+batch.to_csv()
 
 print("Generating data for stage 2 agents")
-for seed in tqdm(range(100)):
-    model_params["seed"] = seed
-    model_params["stage"] = "Beards with one alele"
-    model_params["child_cost"] = 3
-    model = Model(**model_params)
-    model.run(20)
-    data = model.datacollector.get_model_vars_dataframe()
-    if not data.empty:
-        data.to_csv(model.filename)
+model_params["stage"] = "Beards with one alele"
+model_params["child_cost"] = 3
+batch = BatchModel(seeds, **model_params)
+batch.run(20)
+batch.to_csv()
 
 print("Generating data for stage 3 agents")
-for seed in tqdm(range(100)):
-    model_params["seed"] = seed
-    model_params["stage"] = "Beards with two aleles"
-    model_params["child_cost"] = 1
-    model = Model(**model_params)
-    model.run(20)
-    data = model.datacollector.get_model_vars_dataframe()
-    if not data.empty:
-        data.to_csv(model.filename)
+model_params["stage"] = "Beards with two aleles"
+model_params["child_cost"] = 1
+batch = BatchModel(seeds, **model_params)
+batch.run(20)
+batch.to_csv()
 
 print("Generating data for stage 4 agents")
-for seed in tqdm(range(100)):
-    model_params["seed"] = seed
-    model_params["stage"] = "Reputation"
-    model_params["child_cost"] = 1
-    model = Model(**model_params)
-    model.run(20)
-    data = model.datacollector.get_model_vars_dataframe()
-    if not data.empty:
-        data.to_csv(model.filename)
\ No newline at end of file
+model_params["stage"] = "Reputation"
+model_params["child_cost"] = 1
+batch = BatchModel(seeds, **model_params)
+batch.run(20)
+batch.to_csv()
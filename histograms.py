@@ -0,0 +1,55 @@
+import numpy as np
+
+
+class TraitHistograms:
+    """Histograms of the trust and reputation of a Reputation stage model, with their joint histogram.
+
+    Values from 0 to 100 fall into bins of equal width, 100 into the last one.
+    The joint histogram of a step comes from a single bincount over the
+    population, and the histogram of each trait is a sum of it, so a step costs
+    a few array operations and its row holds bins * (bins + 2) counts, whatever
+    the population. Histograms of the latest step are reported as metric columns.
+    """
+
+    # Metric column of each histogram, the joint one indexed by trust bin then reputation bin
+    columns = {
+        "trust": "Trust Histogram",
+        "reputation": "Reputation Histogram",
+        "joint": "Trust Reputation Histogram",
+    }
+
+    def __init__(self, model, bins=10):
+        self.model = model
+        self.bins = bins
+        self.edges = np.linspace(0, 100, bins + 1)
+        # Joint histogram of the step it was computed at, shared by the reporters
+        self.step = None
+        self.histogram = None
+
+    def traits(self):
+        """Returns the trust and reputation of every agent, as two arrays."""
+        engine = self.model.engine
+        if engine is not None:
+            return engine.trust[0], engine.reputation[0]
+        values = np.array([(agent.trust, agent.reputation) for agent in self.model.agents], dtype=np.int64)
+        values = values.reshape(-1, 2)
+        return values[:, 0], values[:, 1]
+
+    def joint(self):
+        """Returns the joint histogram of trust and reputation at the current step."""
+        if self.step != self.model.steps:
+            trust, reputation = self.traits()
+            trust_bins = np.minimum(trust.astype(np.int64) * self.bins // 100, self.bins - 1)
+            reputation_bins = np.minimum(reputation.astype(np.int64) * self.bins // 100, self.bins - 1)
+            counts = np.bincount(trust_bins * self.bins + reputation_bins, minlength=self.bins**2)
+            self.histogram = counts.astype(np.int32).reshape(self.bins, self.bins)
+            self.step = self.model.steps
+        return self.histogram
+
+    def reporters(self):
+        """Reporters of the histograms of the latest step, keyed on column name."""
+        return {
+            self.columns["trust"]: lambda: self.joint().sum(axis=1, dtype=np.int32),
+            self.columns["reputation"]: lambda: self.joint().sum(axis=0, dtype=np.int32),
+            self.columns["joint"]: self.joint,
+        }
@@ -0,0 +1,44 @@
+"""
+Deterministic mean-field preview of the Simple and Beard stages.
+"""
+import copy
+
+from engines import MeanFieldEngine
+from model import Model
+
+
+class MeanFieldModel:
+    """Expected trajectories of the metrics of a Model, from the replicator dynamics of its genotypes.
+
+    Takes the arguments of Model that the expected dynamics depend on. A whole
+    trajectory costs a few array operations on the genotypes per step, whatever
+    the population, so it can follow every move of a slider.
+    """
+
+    payoff = Model.payoff
+    reporters = Model.reporters
+
+    # The engine reads the payoffs through the model, like it does with Model
+    get_payoff = Model.get_payoff
+
+    def __init__(self, initial_pop=50, payoffs=None, distribution=0.5, stage="Simple", child_cost=1, carrying_capacity=None):
+        self.child_cost = child_cost
+        self.carrying_capacity = carrying_capacity
+        if payoffs is not None:
+            self.payoff = payoffs
+        self.engine = MeanFieldEngine(self, initial_pop, stage, distribution)
+
+    @classmethod
+    def like(cls, model):
+        """Returns the mean-field model of a Model's parameters."""
+        return cls(**{
+            name: model.params[name]
+            for name in ["initial_pop", "payoffs", "distribution", "stage", "child_cost", "carrying_capacity"]
+        })
+
+    def trajectory(self, steps):
+        """Returns the expected value of every metric at the current step and the next steps, keyed on column name."""
+        # Reporters treat each step of the history as a replicate
+        history = copy.copy(self.engine)
+        history.counts = self.engine.trajectory(steps)
+        return {column: getattr(history, reporter)() for column, reporter in self.reporters.items()}
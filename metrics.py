@@ -0,0 +1,218 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def arrow_table(model_vars):
+    """Returns metric columns as an Arrow table sharing memory with them.
+
+    Metrics holding an array per row become fixed size list columns.
+    """
+    import pyarrow as pa
+
+    arrays = {}
+    for name, values in model_vars.items():
+        if values.ndim == 1:
+            arrays[name] = pa.array(values)
+        else:
+            width = int(np.prod(values.shape[1:]))
+            arrays[name] = pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), width)
+    return pa.table(arrays)
+
+
+def scalar_columns(model_vars):
+    """Returns the metric columns holding a single value per row, leaving out those holding arrays such as histograms."""
+    return {name: values for name, values in model_vars.items() if values.ndim == 1}
+
+
+class MetricsCollector:
+    """Columnar replacement for Mesa's DataCollector, holding one NumPy array per metric.
+
+    Reporters are called without arguments and may return a number or an array,
+    such as one value per replicate. Columns take the dtype and shape of the first
+    value collected, are promoted to float if a float arrives in an integer column,
+    and grow by doubling, so collecting a row never copies the previous ones.
+    Only the enabled columns are collected.
+
+    With every=k, only every k-th call of collect() records a row. Given a
+    MetricsSink, rows are written to disk in chunks as they are collected, and
+    with a window, only the latest window rows and those not written yet are kept
+    in memory, older ones being dropped, so memory stays bounded however long
+    the run. offset counts the rows dropped, and steps() numbers the rows kept.
+    """
+
+    def __init__(self, model_reporters, enabled=None, capacity=64, every=1, window=None, sink=None):
+        if enabled is not None:
+            model_reporters = {name: reporter for name, reporter in model_reporters.items() if name in enabled}
+        self.model_reporters = model_reporters
+        self.capacity = capacity
+        self.columns = {}
+        self.rows = 0
+        self.every = every
+        self.window = window
+        self.sink = sink
+        self.calls = 0
+        self.offset = 0
+        self.written = 0
+
+    def collect(self, model=None):
+        """Collect a row with the current value of every reporter, if the row is recorded."""
+        self.calls += 1
+        if (self.calls - 1) % self.every:
+            return
+        # The previous row is complete once the next one starts, set_last included
+        if self.sink is not None and self.rows - self.written >= self.sink.chunk_rows:
+            self.flush()
+        if self.rows == self.capacity:
+            self.make_room()
+        for name, reporter in self.model_reporters.items():
+            value = np.asarray(reporter())
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = np.zeros((self.capacity, *value.shape), dtype=value.dtype)
+            elif value.dtype.kind == "f" and column.dtype.kind != "f":
+                column = self.columns[name] = column.astype(np.float64)
+            column[self.rows] = value
+        self.rows += 1
+
+    def set_last(self, name, value):
+        """Replace the value of a metric in the latest row collected, if the latest call recorded one."""
+        if name in self.columns and (self.calls - 1) % self.every == 0:
+            self.columns[name][self.rows - 1] = value
+
+    def flush(self):
+        """Write the rows not written yet to the sink."""
+        if self.sink is None or self.written == self.rows:
+            return
+        self.sink.write(
+            {name: column[self.written:self.rows] for name, column in self.columns.items()},
+            self.steps()[self.written:],
+        )
+        self.written = self.rows
+
+    def load(self, model_vars, offset=0, calls=None):
+        """Replace the collected rows by the given columns, such as those of model_vars.
+
+        offset is the number of rows dropped before the first one, and calls the
+        number of calls of collect() so far, one per recorded row by default.
+        """
+        self.columns = {name: np.array(values) for name, values in model_vars.items()}
+        self.rows = len(next(iter(self.columns.values()), []))
+        self.capacity = max(self.rows, 1)
+        self.offset = offset
+        self.written = 0
+        self.calls = (offset + self.rows) * self.every if calls is None else calls
+
+    def make_room(self):
+        """Drop the rows beyond the window that are written, or double the number of rows the columns can hold."""
+        drop = 0
+        if self.window is not None:
+            drop = max(self.rows - self.window, 0)
+            if self.sink is not None:
+                drop = min(drop, self.written)
+        # Dropping fewer rows than half the columns would copy them too often
+        if drop < self.capacity // 2:
+            self.grow()
+            return
+        # Kept rows move to new memory, leaving snapshots of the old columns untouched
+        for name, column in self.columns.items():
+            kept = np.zeros_like(column)
+            kept[:self.rows - drop] = column[drop:self.rows]
+            self.columns[name] = kept
+        self.rows -= drop
+        self.written -= drop
+        self.offset += drop
+
+    def grow(self):
+        """Double the number of rows the columns can hold."""
+        self.capacity *= 2
+        for name, column in self.columns.items():
+            grown = np.zeros((self.capacity, *column.shape[1:]), dtype=column.dtype)
+            grown[:self.rows] = column[:self.rows]
+            self.columns[name] = grown
+
+    def steps(self):
+        """Returns the step of every row kept in memory."""
+        return (self.offset + np.arange(self.rows)) * self.every
+
+    @property
+    def model_vars(self):
+        """Collected values of each metric, as views on the columns."""
+        return {name: column[:self.rows] for name, column in self.columns.items()}
+
+    def snapshot(self):
+        """Returns the metrics collected so far, as a MetricsSnapshot that later rows do not change."""
+        return MetricsSnapshot(self, self.rows, self.model_vars, self.offset, self.every)
+
+    def get_model_vars_dataframe(self):
+        """Returns the collected metrics as a DataFrame sharing memory with the columns, indexed by step.
+
+        Metrics holding an array per row, such as histograms, are left out.
+        """
+        return pd.DataFrame(scalar_columns(self.model_vars), index=self.steps(), copy=False)
+
+    def to_arrow(self):
+        """Returns the collected metrics as an Arrow table sharing memory with the columns.
+
+        Metrics holding an array per row become fixed size list columns.
+        """
+        return arrow_table(self.model_vars)
+
+
+class MetricsSnapshot:
+    """Metrics of a MetricsCollector up to some row, safe to read while it keeps collecting.
+
+    The columns are views, so taking a snapshot copies nothing. Collecting only
+    writes rows after the snapshot, set_last only its own latest row, and growing,
+    promoting a column or dropping rows moves it to new memory, leaving the views
+    untouched.
+    """
+
+    def __init__(self, collector, rows, model_vars, offset=0, every=1):
+        self.collector = collector
+        self.rows = rows
+        self.model_vars = model_vars
+        self.offset = offset
+        self.every = every
+
+    def steps(self):
+        return (self.offset + np.arange(self.rows)) * self.every
+
+    def get_model_vars_dataframe(self):
+        return pd.DataFrame(scalar_columns(self.model_vars), index=self.steps(), copy=False)
+
+
+class MetricsSink:
+    """Writes chunks of rows of a MetricsCollector to a directory, one Parquet file per chunk.
+
+    Files are named after the first step they hold and written under a temporary
+    name first, so a crashed run keeps every chunk written before the crash,
+    and a run restored from a checkpoint writes over the steps it runs again.
+    """
+
+    def __init__(self, path, chunk_rows=10_000):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, model_vars, steps):
+        """Write the rows of some metric columns, with the step of each row."""
+        import pyarrow.parquet as pq
+
+        table = arrow_table({"Step": steps, **model_vars})
+        filename = os.path.join(self.path, f"steps-{steps[0]:012d}.parquet")
+        temporary = f"{filename}.{os.getpid()}.tmp"
+        pq.write_table(table, temporary)
+        os.replace(temporary, filename)
+
+    def read(self):
+        """Returns every row written as a DataFrame indexed by step, the latest write of a step winning."""
+        import pyarrow.parquet as pq
+
+        files = sorted(glob.glob(os.path.join(self.path, "steps-*.parquet")), key=os.path.getmtime)
+        if not files:
+            return pd.DataFrame()
+        data = pd.concat([pq.read_table(file).to_pandas() for file in files], ignore_index=True)
+        return data.drop_duplicates("Step", keep="last").set_index("Step").sort_index()
@@ -1,31 +1,121 @@
-from mesa import DataCollector, Model as MesaModel
+import random
+import threading
+from collections import defaultdict
+from contextlib import nullcontext
+
+import numpy as np
+from mesa import Model as MesaModel
 from mesa.discrete_space import OrthogonalMooreGrid
 from agents import SimpleAgent, BeardAgent, ReputationAgent
+from engines import CountEngine, GridEngine, NetworkEngine, ReputationEngine
+from counters import PopulationCounters
+from metrics import MetricsCollector, MetricsSink
+from histograms import TraitHistograms
+from timings import StepTimings
+
+def metrics_filename(seed, initial_pop, activation_order, payoffs, distribution, stage, child_cost):
+    """Path of the CSV file holding the metrics of a seeded run."""
+    params =f"seed_{seed} " + \
+        f"initial_pop_{initial_pop} " + \
+        f"activation_order_{activation_order} " + \
+        f"payoffs_{payoffs} " + \
+        f"distribution_{distribution} " + \
+        f"child_cost_{child_cost} "
+    return f"./data/{stage}/metrics ({params}).csv"
 
 class Model(MesaModel):
     """Model class for iterated, spatial prisoner's dilemma model."""
 
     activation_regimes = ["Sequential", "Random", "Simultaneous"]
     simulation_stages = ["Simple", "Beards with one alele", "Beards with two aleles", "Reputation"]
+    # "Agents" keeps one Mesa agent per individual, "Counts" only the number per genotype,
+    # "Arrays" the reputation agents' state as NumPy arrays, "Grid" the genotype
+    # of every cell of a grid_size x grid_size grid and "Network" that of every node
+    # of a graph, agents only meeting their neighbours
+    engines = ["Agents", "Counts", "Arrays", "Grid", "Network"]
+    # Stages each engine supports, the others raising a ValueError
+    engine_stages = {
+        "Agents": simulation_stages,
+        "Counts": simulation_stages[:3],
+        "Arrays": ["Reputation"],
+        "Grid": simulation_stages[:3],
+        "Network": simulation_stages[:3],
+    }
+
+    # Kinds of draws that have their own stream with common random numbers
+    random_streams = ["traits", "pairing", "activation", "offspring", "cull"]
 
     # This dictionary holds the payoff for the agents,
     # keyed on: (my_move, other_move)
     payoff = {("C", "C"): 3, ("C", "D"): 0.5, ("D", "C"): 5.5, ("D", "D"): 1}
 
+    # Metrics to graph, keyed on column name, with the name of their reporter method
+    reporters = {
+        # Always relevant
+        "All Agents": "num_agents",
+        # Relevant for stage 1
+        "Cooperating Agents": "num_cooperating_agents",
+        "Non-Cooperating Agents": "num_non_cooperating_agents",
+        # Relevant for stage 2 and 3
+        "Impostors": "num_impostors",
+        "Cowards": "num_cowards",
+        "True Beards": "num_true_beards",
+        "Suckers": "num_suckers",
+        # Relevant for stage 4
+        "Outcast Agents": "num_outcasts",
+        "Noble Agents": "num_nobles",
+        "Average Reputation": "avg_reputation",
+        "Average Trust": "avg_trust",
+        "Cooperate Actions": "count_cooperate_actions",
+        "Defect Actions": "count_defect_actions",
+        "Outcast Reputation": "avg_rep_outcasts",
+        "Outcast Trust": "avg_trust_outcasts",
+        "Noble Reputation": "avg_rep_nobles",
+        "Noble Trust": "avg_trust_nobles",
+    }
+
+    # Metrics that apply to each stage, the only ones collected with stage_metrics_only
+    stage_metrics = {
+        "Simple": ["All Agents", "Cooperating Agents", "Non-Cooperating Agents"],
+        "Beards with one alele": [
+            "All Agents", "Cooperating Agents", "Non-Cooperating Agents",
+            "Impostors", "Cowards", "True Beards", "Suckers",
+        ],
+        "Beards with two aleles": [
+            "All Agents", "Cooperating Agents", "Non-Cooperating Agents",
+            "Impostors", "Cowards", "True Beards", "Suckers",
+        ],
+        "Reputation": [
+            "All Agents", "Outcast Agents", "Noble Agents", "Average Reputation", "Average Trust",
+            "Cooperate Actions", "Defect Actions", "Outcast Reputation", "Outcast Trust",
+            "Noble Reputation", "Noble Trust",
+        ],
+    }
+
     def __init__(
         self, initial_pop=50, activation_order="Random", payoffs=None, seed=None, distribution=0.5, stage="Simple", child_cost=1,
+        engine="Agents", stage_metrics_only=False, carrying_capacity=None, stop_on_fixation=False, grid_size=50,
+        graph=None, timings=False, common_random_numbers=False, record_every=1, metrics_window=None, metrics_path=None,
+        histograms=False,
     ):
         super().__init__(seed=seed)
+        # Arguments the model was created with, so that a checkpoint can create it again
+        self.params = {
+            "initial_pop": initial_pop, "activation_order": activation_order, "payoffs": payoffs, "seed": seed,
+            "distribution": distribution, "stage": stage, "child_cost": child_cost, "engine": engine,
+            "stage_metrics_only": stage_metrics_only, "carrying_capacity": carrying_capacity,
+            "stop_on_fixation": stop_on_fixation, "grid_size": grid_size, "graph": graph, "timings": timings,
+            "common_random_numbers": common_random_numbers, "record_every": record_every,
+            "metrics_window": metrics_window, "metrics_path": metrics_path, "histograms": histograms,
+        }
         if seed is not None:
-            params =f"seed_{seed} " + \
-                f"initial_pop_{initial_pop} " + \
-                f"activation_order_{activation_order} " + \
-                f"payoffs_{payoffs} " + \
-                f"distribution_{distribution} " + \
-                f"child_cost_{child_cost} "
-            self.filename = f"./data/{stage}/metrics ({params}).csv"
+            self.filename = metrics_filename(seed, initial_pop, activation_order, payoffs, distribution, stage, child_cost)
         self.activation_order = activation_order
         self.child_cost = child_cost
+        self.stage = stage
+        # Offspring beyond the carrying capacity are culled at random
+        self.carrying_capacity = carrying_capacity
+        self.stop_on_fixation = stop_on_fixation
 
         #TODO: Change grid model to something more appropriate
         self.grid = OrthogonalMooreGrid((50, 50), torus=True, random=self.random)
@@ -33,39 +123,76 @@ class Model(MesaModel):
         if payoffs is not None:
             self.payoff = payoffs
 
-        # Create agents based on the stage and distribution
-        self.create_agents(initial_pop, stage, distribution)
+        # Kept up to date by the agents, so that reporters never scan the population
+        self.counters = PopulationCounters()
+        # Dead agents of each class, reused by the next ones spawned, at most as many as the living after a step
+        self.agent_pool = defaultdict(list)
+        # Agents that settled their payoff this step, waiting for reproduce()
+        self.parents = []
+        self.payoffs = []
+
+        # With common random numbers, every kind of draw has its own stream, restarted
+        # each step from the seed, so that models sharing a seed but not their other
+        # parameters reuse the same draws wherever their trajectories line up
+        self.common_random_numbers = common_random_numbers
+        if common_random_numbers:
+            if engine != "Agents":
+                raise ValueError(f"Common random numbers are not supported by the {engine} engine")
+            self.streams = dict(zip(self.random_streams, np.random.SeedSequence(seed).spawn(len(self.random_streams))))
+        # Initial traits left to chance are all drawn from one generator
+        self.traits_random = self.stream_random("traits")
+
+        # Create the population based on the engine, stage and distribution
+        match engine:
+            case "Agents":
+                self.engine = None
+                self.create_agents(initial_pop, stage, distribution)
+            case "Counts":
+                self.engine = CountEngine(self, initial_pop, stage, distribution)
+            case "Arrays":
+                self.engine = ReputationEngine(self, initial_pop, stage, distribution)
+            case "Grid":
+                self.engine = GridEngine(self, initial_pop, stage, distribution, size=grid_size)
+            case "Network":
+                self.engine = NetworkEngine(self, initial_pop, stage, distribution, graph=graph)
+            case _:
+                raise ValueError(f"Unknown engine: {engine}")
 
+        # Wall time of each phase of a step, with births and deaths, only recorded if asked to
+        self.timings = StepTimings() if timings else None
+        # Histograms of trust and reputation, only recorded in the Reputation stage if asked to
+        self.histograms = TraitHistograms(self) if histograms and stage == "Reputation" else None
 
         # Defines metrics to graph
-        self.datacollector = DataCollector(
-            {
-                # Always relevant
-                "All Agents": self.num_agents,
-                # Relevant for stage 1
-                "Cooperating Agents": self.num_cooperating_agents,
-                "Non-Cooperating Agents": self.num_non_cooperating_agents,
-                # Relevant for stage 2 and 3
-                "Impostors": self.num_impostors,
-                "Cowards": self.num_cowards,
-                "True Beards": self.num_true_beards,
-                "Suckers": self.num_suckers,
-                # Relevant for stage 4
-                "Outcast Agents": self.num_outcasts,
-                "Noble Agents": self.num_nobles,
-                "Average Reputation": self.avg_reputation,
-                "Average Trust": self.avg_trust,
-                "Cooperate Actions": self.count_cooperate_actions,
-                "Defect Actions": self.count_defect_actions,
-                "Outcast Reputation": self.avg_rep_outcasts,
-                "Outcast Trust": self.avg_trust_outcasts,
-                "Noble Reputation": self.avg_rep_nobles,
-                "Noble Trust": self.avg_trust_nobles
+        if self.engine is None:
+            model_reporters = {column: getattr(self, reporter) for column, reporter in self.reporters.items()}
+        else:
+            # Engines report one value per replicate, and the model holds a single one
+            model_reporters = {
+                column: lambda reporter=reporter: getattr(self.engine, reporter)()[0].item()
+                for column, reporter in self.reporters.items()
             }
+        enabled = self.stage_metrics[stage] if stage_metrics_only else None
+        if self.timings is not None:
+            model_reporters.update(self.timings.reporters())
+            if enabled is not None:
+                enabled = enabled + list(self.timings.reporters())
+        if self.histograms is not None:
+            model_reporters.update(self.histograms.reporters())
+            if enabled is not None:
+                enabled = enabled + list(self.histograms.reporters())
+        # Long runs may record every k-th step only, stream rows to disk and keep a window of them in memory
+        self.datacollector = MetricsCollector(
+            model_reporters, enabled=enabled, every=record_every, window=metrics_window,
+            sink=None if metrics_path is None else MetricsSink(metrics_path),
         )
 
+        # Held while stepping, so that threads sharing the model take their steps one at a time
+        self.step_lock = threading.RLock()
+
         self.running = True
         self.datacollector.collect(self)
+        self.check_termination()
 
     def create_agents(self, initial_pop, stage, distribution):
         """Create agents in the model."""
@@ -90,42 +217,182 @@ class Model(MesaModel):
             case _:
                 raise ValueError(f"Unknown stage: {stage}")
 
+    def stream(self, kind):
+        """Returns the NumPy generator of a kind of draws for the current step, the model's own one by default."""
+        if not self.common_random_numbers:
+            return self.rng
+        base = self.streams[kind]
+        return np.random.default_rng(np.random.SeedSequence(base.entropy, spawn_key=(*base.spawn_key, self.steps)))
+
+    def stream_random(self, kind):
+        """Returns the random module generator of a kind of draws for the current step, the model's own one by default."""
+        if not self.common_random_numbers:
+            return self.random
+        return random.Random(int(self.stream(kind).integers(2**63)))
+
     def match_agents(self):
         """Match agents with their opponents."""
         agents_copy = list(self.agents)
-        self.random.shuffle(agents_copy)
-        self.opponents = {}
-        for _ in range(len(self.agents) // 2):
-            agent1 = agents_copy.pop()
-            agent2 = agents_copy.pop()
-            self.opponents[agent1] = agent2
-            self.opponents[agent2] = agent1
+        self.stream_random("pairing").shuffle(agents_copy)
+        # Pairs are taken from the end of the shuffled agents,
+        # and with an odd population the first one is left unmatched
+        agents_copy.reverse()
+        matched = len(agents_copy) // 2 * 2
+        self.pairs = list(zip(agents_copy[0:matched:2], agents_copy[1:matched:2]))
+        self.unmatched = agents_copy[matched:]
+        self.opponents = dict(self.pairs)
+        self.opponents.update((agent2, agent1) for agent1, agent2 in self.pairs)
 
     def get_payoff(self, agent1_action, agent2_action):
         """Get the payoff for a pair of agents based on their actions."""
         return self.payoff[(agent1_action, agent2_action)]/self.child_cost
 
     def step(self):
-        self.match_agents()
-        # Activate all agents, based on the activation regime
-        match self.activation_order:
-            case "Sequential":
-                self.agents.do("step")
-            case "Random":
-                self.agents.shuffle_do("step")
-            case "Simultaneous":
-                self.agents.do("step")
-                self.agents.do("advance")
-            case _:
-                raise ValueError(f"Unknown activation order: {self.activation_order}")
+        if self.timings is not None:
+            self.timings.start()
+
+        if self.engine is not None:
+            population = self.engine.num_agents()[0]
+            with self.timed("engine"):
+                self.engine.step()
+            # A generation replaces the previous one, in every stage but Reputation
+            # Like on the Agents engine, children culled by the carrying capacity are born, then die
+            if self.timings is not None and self.stage != "Reputation":
+                born = int(self.engine.born[0])
+                culled = born - int(self.engine.num_agents()[0])
+                self.timings.count(
+                    births=born, deaths=int(population) + culled, unplaced=int(self.engine.unplaced[0])
+                )
+        else:
+            with self.timed("match"):
+                self.match_agents()
+            # Activate all agents, based on the activation regime
+            with self.timed("activation"):
+                match self.activation_order:
+                    case "Sequential":
+                        self.agents.do("step")
+                    case "Random" if self.common_random_numbers:
+                        agents = list(self.agents)
+                        self.stream_random("activation").shuffle(agents)
+                        for agent in agents:
+                            agent.step()
+                    case "Random":
+                        self.agents.shuffle_do("step")
+                    case "Simultaneous":
+                        self.play_pairs()
+                    case _:
+                        raise ValueError(f"Unknown activation order: {self.activation_order}")
+            with self.timed("reproduction"):
+                if self.parents:
+                    self.reproduce()
+            with self.timed("cull"):
+                if self.carrying_capacity is not None:
+                    self.cull()
+                self.trim_pool()
 
         # Collect data
-        self.datacollector.collect(self)
+        with self.timed("collect"):
+            self.datacollector.collect(self)
+        if self.timings is not None:
+            # Collecting reported the time of the phases before it only
+            self.datacollector.set_last(StepTimings.phases["collect"], self.timings.seconds["collect"])
+        self.check_termination()
+
+    def timed(self, phase):
+        """Context timing a phase of the step, when timings are recorded."""
+        if self.timings is None:
+            return nullcontext()
+        return self.timings.phase(phase)
+
+    def play_pairs(self):
+        """Resolve every match once, with the outcome of activating all agents simultaneously.
+
+        Matches are disjoint, so a pair settles its payoffs as soon as they are known,
+        and births and deaths wait for reproduce().
+        """
+        for agent, opponent in self.pairs:
+            agent_action, opponent_action = agent.get_actions(opponent)
+            agent.settle(agent.get_payoff_from_actions(agent_action, opponent_action))
+            opponent.settle(opponent.get_payoff_from_actions(opponent_action, agent_action))
+        for agent in self.unmatched:
+            agent.settle(agent.default_score)
+
+    def reproduce(self):
+        """Replace every parent of this step by its children, created in bulk per genotype."""
+        parents, payoffs = self.parents, np.array(self.payoffs, dtype=float)
+        self.parents, self.payoffs = [], []
+
+        # One child per whole unit of payoff, and one more with the fractional part as probability
+        whole = np.floor(payoffs)
+        children = whole.astype(np.int64) + (self.stream("offspring").random(len(payoffs)) < payoffs - whole)
+
+        if self.timings is not None:
+            self.timings.count(births=int(children.sum()), deaths=len(parents))
+
+        # Parents die first, so that their instances are reused by the children
+        genotypes = {}
+        for parent, n in zip(parents, children.tolist()):
+            genotype = genotypes.get(parent.counter_key())
+            if genotype is None:
+                genotypes[parent.counter_key()] = [parent, parent.genes(), 1, n]
+            else:
+                genotype[2] += 1
+                genotype[3] += n
+            parent.die(tally=False)
+
+        # Dead parents leave the population counters once per genotype, before any is reused
+        for parent, genes, deaths, n in genotypes.values():
+            self.counters.add(parent, sign=-deaths)
+        for parent, genes, deaths, n in genotypes.values():
+            type(parent).spawn_agents(self, n, **genes)
+
+    def cull(self):
+        """Remove random agents until the population fits within the carrying capacity."""
+        excess = len(self.agents) - self.carrying_capacity
+        if excess > 0:
+            if self.timings is not None:
+                self.timings.count(deaths=excess)
+            for agent in self.stream_random("cull").sample(list(self.agents), excess):
+                agent.die()
+
+    def trim_pool(self):
+        """Free the dead agents pooled beyond the size of the population, such as those of a cull or a collapse."""
+        for pool in self.agent_pool.values():
+            del pool[len(self.agents):]
+
+    def is_decided(self):
+        """Returns whether the population went extinct or a single genotype has fixed."""
+        if self.engine is not None:
+            return bool(self.engine.decided()[0])
+        if not self.agents:
+            return True
+        # Reputation agents never reproduce, so no genotype can take over
+        if self.stage == "Reputation":
+            return False
+        return self.counters.num_keys() == 1
+
+    def check_termination(self):
+        """Stop the model once its outcome is decided, if asked to."""
+        if self.stop_on_fixation and self.is_decided():
+            self.running = False
+
+    def _wrapped_step(self, *args, **kwargs):
+        # Mesa counts the step before calling step(), which the lock covers too
+        with self.step_lock:
+            super()._wrapped_step(*args, **kwargs)
 
     def run(self, n):
-        """Run the model for n steps."""
-        for _ in range(n):
-            self.step()
+        """Run the model for n steps, or until it stops running.
+
+        Rows not written to the metrics path yet are written at the end, even if a step fails.
+        """
+        try:
+            for _ in range(n):
+                if not self.running:
+                    break
+                self.step()
+        finally:
+            self.datacollector.flush()
 
     def num_agents(self):
         """Returns the number of agents in the model."""
@@ -134,142 +401,64 @@ class Model(MesaModel):
     # Relevant for stage 1
     def num_cooperating_agents(self):
         """Returns the number of cooperating agents in the model based on stage."""
-        if not self.agents:
-            return 0
-
-        first_agent = self.agents[0]
-
-        if isinstance(first_agent, SimpleAgent):
-            return len([a for a in self.agents if a.action == "C"])
-
-        elif isinstance(first_agent, BeardAgent):
-            return len([a for a in self.agents if a.is_beard_altruistic])
-
-        elif isinstance(first_agent, ReputationAgent):
-            return len([a for a in self.agents if not a.reputation >= 50])
-
-        else:
-            return 0
+        return self.counters.total("cooperating")
 
     def num_non_cooperating_agents(self):
-        """Returns the number of cooperating agents in the model based on stage."""
-        if not self.agents:
-            return 0
-
-        first_agent = self.agents[0]
-
-        if isinstance(first_agent, SimpleAgent):
-            return len([a for a in self.agents if a.action == "D"])
-
-        elif isinstance(first_agent, BeardAgent):
-            return len([a for a in self.agents if not a.is_beard_altruistic])
-
-        elif isinstance(first_agent, ReputationAgent):
-            return len([a for a in self.agents if a.reputation < 50])
-
-        else:
-            return 0
+        """Returns the number of non-cooperating agents in the model based on stage."""
+        return self.counters.total("non_cooperating")
 
     # Relevant for stage 2 and 3
     def num_impostors(self):
         """Returns the number of impostor agents in the model."""
-        if not self.agents or type(self.agents[0]) != BeardAgent:
-            return 0
-        return len([a for a in self.agents if not a.is_beard_altruistic and a.has_beard])
-    
+        return self.counters.total("impostor")
+
     def num_cowards(self):
         """Returns the number of coward agents in the model."""
-        if not self.agents or type(self.agents[0]) != BeardAgent:
-            return 0
-        return len([a for a in self.agents if not a.has_beard and not a.is_beard_altruistic])
-    
+        return self.counters.total("coward")
+
     def num_true_beards(self):
         """Returns the number of true bearded agents in the model."""
-        if not self.agents or type(self.agents[0]) != BeardAgent:
-            return 0
-        return len([a for a in self.agents if a.has_beard and a.is_beard_altruistic])
-    
+        return self.counters.total("true_beard")
+
     def num_suckers(self):
         """Returns the number of sucker agents in the model."""
-        if not self.agents or type(self.agents[0]) != BeardAgent:
-            return 0
-        return len([a for a in self.agents if not a.has_beard and a.is_beard_altruistic])
-    
+        return self.counters.total("sucker")
+
     # Relevant for stage 4
     def num_outcasts(self):
         """Returns the number of low reputation agents in the model."""
-        if not self.agents or type(self.agents[0]) != ReputationAgent:
-            return 0
-        return len([a for a in self.agents if a.reputation < 50])
+        return self.counters.total("outcast")
 
     def num_nobles(self):
         """Returns the number of high reputation agents in the model."""
-        if not self.agents or type(self.agents[0]) != ReputationAgent:
-            return 0
-        return len([a for a in self.agents if a.reputation >= 50])
+        return self.counters.total("noble")
 
     def avg_reputation(self):
         """Returns the average reputation of agents in the model."""
-        if not self.agents or type(self.agents[0]) != ReputationAgent:
-            return 0
-        return sum(a.reputation for a in self.agents) / len(self.agents)
-    
+        return self.counters.mean("reputation", "reputation")
+
     def avg_trust(self):
         """Returns the average trust of agents in the model."""
-        if not self.agents or type(self.agents[0]) != ReputationAgent:
-            return 0
-        return sum(a.trust for a in self.agents) / len(self.agents)
+        return self.counters.mean("reputation", "trust")
 
     def count_cooperate_actions(self):
-        if not self.agents or type(self.agents[0]) != ReputationAgent:
-            return 0
-        return sum(1 for a in self.agents if getattr(a, "last_action", None) == "C")
+        return self.counters.total("cooperate_action")
 
     def count_defect_actions(self):
-        if not self.agents or type(self.agents[0]) != ReputationAgent:
-            return 0
-        return sum(1 for a in self.agents if getattr(a, "last_action", None) == "D")
+        return self.counters.total("defect_action")
 
     def avg_trust_outcasts(self):
-        """Returns the average trust of impostor agents in the model."""
-        if not self.agents or type(self.agents[0]) != ReputationAgent:
-            return 0
-
-        impostors = [a for a in self.agents if a.reputation < 50]
-        if not impostors:
-            return 0
-
-        return sum(a.trust for a in impostors) / len(impostors)
+        """Returns the average trust of low reputation agents in the model."""
+        return self.counters.mean("outcast", "trust")
 
     def avg_trust_nobles(self):
-        """Returns the average trust of impostor agents in the model."""
-        if not self.agents or type(self.agents[0]) != ReputationAgent:
-            return 0
-
-        altruists = [a for a in self.agents if a.reputation > 50]
-        if not altruists:
-            return 0
-
-        return sum(a.trust for a in altruists) / len(altruists)
+        """Returns the average trust of agents with a reputation above 50 in the model."""
+        return self.counters.mean("above_neutral", "trust")
 
     def avg_rep_outcasts(self):
-        """Returns the average trust of impostor agents in the model."""
-        if not self.agents or type(self.agents[0]) != ReputationAgent:
-            return 0
-
-        impostors = [a for a in self.agents if a.reputation < 50]
-        if not impostors:
-            return 0
-
-        return sum(a.reputation for a in impostors) / len(impostors)
+        """Returns the average reputation of low reputation agents in the model."""
+        return self.counters.mean("outcast", "reputation")
 
     def avg_rep_nobles(self):
-        """Returns the average trust of impostor agents in the model."""
-        if not self.agents or type(self.agents[0]) != ReputationAgent:
-            return 0
-
-        altruists = [a for a in self.agents if a.reputation > 50]
-        if not altruists:
-            return 0
-
-        return sum(a.reputation for a in altruists) / len(altruists)
+        """Returns the average reputation of agents with a reputation above 50 in the model."""
+        return self.counters.mean("above_neutral", "reputation")
@@ -0,0 +1,178 @@
+"""
+Replicates of each configuration run until a final-step metric is known precisely enough.
+"""
+import argparse
+import math
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from batch import BatchModel
+from model import Model
+from sweep import number, parameter_grid, run_sweep
+
+
+def t_quantile(p, df):
+    """Quantile of Student's t distribution, from the Cornish-Fisher expansion around the normal one.
+
+    Within 0.5% of the exact value from 3 degrees of freedom up, for the usual confidence levels.
+    """
+    z = NormalDist().inv_cdf(p)
+    return (
+        z
+        + (z**3 + z) / (4 * df)
+        + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * df**2)
+        + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * df**3)
+        + (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / (92160 * df**4)
+    )
+
+
+class RunningStats:
+    """Count, mean and variance of a stream of values, updated a batch at a time without keeping the values.
+
+    Batches are merged into the totals with the parallel form of Welford's
+    algorithm, which stays accurate however large the mean is against the spread.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        mean = values.mean()
+        m2 = np.square(values - mean).sum()
+        count = self.count + len(values)
+        delta = mean - self.mean
+        self.mean += delta * len(values) / count
+        self.m2 += m2 + delta**2 * self.count * len(values) / count
+        self.count = count
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    def half_width(self, confidence=0.95):
+        """Half the width of the confidence interval of the mean, infinite before two values."""
+        if self.count < 2:
+            return math.inf
+        return t_quantile((1 + confidence) / 2, self.count - 1) * math.sqrt(self.variance() / self.count)
+
+
+def final_values(batch, metric):
+    """Returns the value of a metric at the last step of every replicate of a BatchModel."""
+    # Replicates that stopped early report their last step
+    return batch.datacollector.model_vars[metric][batch.lengths - 1, np.arange(len(batch.seeds))]
+
+
+class ReplicateController:
+    """Runs seeds of every configuration in batches, until the mean of a final-step metric is precise enough.
+
+    A configuration is done once the confidence interval of the mean of the
+    metric is at most width wide, or max_seeds seeds were run. Each round runs
+    the next batch_size seeds of every configuration not done yet, so easy
+    configurations stop early and later rounds only go to the hard ones. Only
+    running statistics of the metric are kept, never the runs.
+    Configuration i runs seeds 0, 1, 2... in order, like generate_data.py.
+    """
+
+    def __init__(self, configs, metric, width, steps=20, batch_size=10, max_seeds=1000, confidence=0.95, processes=None):
+        # t_quantile is only accurate from 3 degrees of freedom up, which the first batch must reach
+        if min(batch_size, max_seeds) < 4:
+            raise ValueError("Batches need at least four seeds for an accurate confidence interval")
+        self.configs = list(configs)
+        self.metric = metric
+        self.width = width
+        self.steps = steps
+        self.batch_size = batch_size
+        self.max_seeds = max_seeds
+        self.confidence = confidence
+        self.processes = processes
+        self.stats = [RunningStats() for _ in self.configs]
+
+    def done(self, stats):
+        return stats.count >= self.max_seeds or 2 * stats.half_width(self.confidence) <= self.width
+
+    def run(self):
+        """Run rounds of batches until every configuration is done, returning the summary."""
+        while True:
+            pending = [(params, stats) for params, stats in zip(self.configs, self.stats) if not self.done(stats)]
+            if not pending:
+                return self.summary()
+            self.run_round(pending)
+
+    def run_round(self, pending):
+        """Run the next batch of seeds of every pending configuration.
+
+        Configurations on the Agents engine share one pass over the worker pool,
+        the others run as a BatchModel each, and those without an engine on the
+        vectorized engine of their stage, like in generate_data.py.
+        """
+        grid, owners = [], []
+        for params, stats in pending:
+            seeds = range(stats.count, min(stats.count + self.batch_size, self.max_seeds))
+            if params.get("engine") == "Agents":
+                grid.extend({**params, "seed": seed} for seed in seeds)
+                owners.extend([stats] * len(seeds))
+            else:
+                batch = BatchModel(seeds, **params)
+                batch.run(self.steps)
+                stats.update(final_values(batch, self.metric))
+
+        values = {}
+        for stats, (_, metrics) in zip(owners, run_sweep(grid, self.steps, self.processes)):
+            values.setdefault(stats, []).append(metrics[self.metric][-1])
+        for stats, batch_values in values.items():
+            stats.update(batch_values)
+
+    def summary(self):
+        """Returns the parameters of every configuration with the seeds run and the mean and interval of the metric."""
+        return pd.DataFrame([
+            {
+                **params,
+                "seeds": stats.count,
+                "mean": stats.mean,
+                "std": math.sqrt(stats.variance()) if stats.count > 1 else math.nan,
+                "half_width": stats.half_width(self.confidence),
+                "precise": 2 * stats.half_width(self.confidence) <= self.width,
+            }
+            for params, stats in zip(self.configs, self.stats)
+        ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run seeds of each configuration until a metric is precise enough.")
+    parser.add_argument("--metric", default="Cooperating Agents", choices=list(Model.reporters))
+    parser.add_argument("--width", type=float, required=True, help="target width of the confidence interval of the mean")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--stage", nargs="+", default=Model.simulation_stages, choices=Model.simulation_stages)
+    parser.add_argument("--initial-pop", nargs="+", type=int, default=[100])
+    parser.add_argument("--activation-order", nargs="+", default=["Simultaneous"], choices=Model.activation_regimes)
+    parser.add_argument("--distribution", nargs="+", type=number, default=[0.5])
+    parser.add_argument("--child-cost", nargs="+", type=number, default=[1])
+    parser.add_argument("--engine", nargs="+", default=[None], choices=Model.engines, help="vectorized engine of each stage by default")
+    parser.add_argument("--carrying-capacity", nargs="+", type=int, default=[None])
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=10, help="seeds run at once per configuration, at least 4")
+    parser.add_argument("--max-seeds", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=None, help="worker processes of the Agents engine, all cores by default")
+    parser.add_argument("--output", default="replicates.csv", help="CSV file of the summary")
+    args = parser.parse_args()
+
+    configs = parameter_grid(
+        stage=args.stage,
+        initial_pop=args.initial_pop,
+        activation_order=args.activation_order,
+        distribution=args.distribution,
+        child_cost=args.child_cost,
+        engine=args.engine,
+        carrying_capacity=args.carrying_capacity,
+    )
+    summary = ReplicateController(
+        configs, args.metric, args.width, args.steps, args.batch_size, args.max_seeds, args.confidence, args.processes
+    ).run()
+    summary.to_csv(args.output, index=False)
+    print(summary.to_string())
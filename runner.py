@@ -0,0 +1,85 @@
+"""
+Background stepping of a model, so that a dashboard never waits on Model.step.
+"""
+import threading
+import time
+
+
+class BackgroundRunner:
+    """Steps a model on a worker thread, publishing a snapshot of its metrics after every step.
+
+    Readers render the latest snapshot whenever they are ready, so a slow reader
+    skips the steps it missed instead of holding the model back. Playing steps
+    the model until it stops running, at most steps_per_second times a second,
+    or as fast as it goes when steps_per_second is 0. Steps taken by other
+    threads, such as those of a dashboard's own controls, wait on the model's
+    step lock, so they never overlap with the runner's.
+    """
+
+    def __init__(self, model, steps_per_second=0):
+        self.model = model
+        self.steps_per_second = steps_per_second
+        self.snapshot = model.datacollector.snapshot()
+        self.step_seconds = 0.0
+        self.playing = False
+        self.pending = 0
+        self.stopped = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="model-runner", daemon=True)
+        self.thread.start()
+
+    def play(self):
+        with self.condition:
+            self.playing = True
+            self.condition.notify()
+
+    def pause(self):
+        with self.condition:
+            self.playing = False
+            self.condition.notify()
+
+    def step(self):
+        """Ask for a single step, taken by the worker thread while paused."""
+        with self.condition:
+            self.pending += 1
+            self.condition.notify()
+
+    def stop(self):
+        """Stop the worker thread once its current step is over."""
+        with self.condition:
+            self.stopped = True
+            self.playing = False
+            self.condition.notify()
+
+    def ready(self):
+        return self.stopped or (self.model.running and (self.playing or self.pending > 0))
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(self.ready)
+                if self.stopped:
+                    return
+                self.pending = max(self.pending - 1, 0)
+
+            start = time.perf_counter()
+            # The snapshot is taken before another thread can step the model
+            with self.model.step_lock:
+                try:
+                    self.model.step()
+                except Exception as error:
+                    self.error = error
+                    self.stopped = True
+                    self.playing = False
+                    return
+                self.step_seconds = time.perf_counter() - start
+                self.snapshot = self.model.datacollector.snapshot()
+            if not self.model.running:
+                self.playing = False
+
+            if self.steps_per_second:
+                delay = start + 1 / self.steps_per_second - time.perf_counter()
+                if delay > 0:
+                    with self.condition:
+                        self.condition.wait_for(lambda: self.stopped or not self.playing, timeout=delay)
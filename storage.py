@@ -0,0 +1,137 @@
+"""
+Partitioned Parquet dataset holding every run of a sweep.
+"""
+import uuid
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from metrics import scalar_columns
+from model import Model
+from timings import StepTimings
+
+# Parameters are stored as typed columns, whatever type they were given as
+parameter_types = {
+    "seed": pa.int64(),
+    "initial_pop": pa.int64(),
+    "activation_order": pa.string(),
+    "payoffs": pa.string(),
+    "distribution": pa.float64(),
+    "stage": pa.string(),
+    "child_cost": pa.float64(),
+    "engine": pa.string(),
+    "carrying_capacity": pa.int64(),
+    "stop_on_fixation": pa.bool_(),
+    "grid_size": pa.int64(),
+    "graph": pa.string(),
+    "timings": pa.bool_(),
+    "common_random_numbers": pa.bool_(),
+    "record_every": pa.int64(),
+    "histograms": pa.bool_(),
+}
+
+# Parameters that are not plain values are stored as their repr
+repr_parameters = ["payoffs", "graph"]
+
+# Averages are floats, every other metric is a count
+metric_types = {
+    column: pa.float64() if reporter.startswith("avg_") else pa.int64()
+    for column, reporter in Model.reporters.items()
+}
+# Columns added by step timings
+metric_types.update({column: pa.float64() for column in StepTimings.phases.values()})
+metric_types.update({"Births": pa.int64(), "Deaths": pa.int64(), "Unplaced": pa.int64()})
+
+
+class ResultStore:
+    """Appends runs to a single Parquet dataset, partitioned by stage.
+
+    Each row holds the parameters of its run and a step. In the "wide" layout
+    it holds every metric of the step as a column, in the "long" layout a single
+    metric name and value. Runs are buffered and written as one file per flush.
+    """
+
+    layouts = ["wide", "long"]
+
+    def __init__(self, path, layout="wide", rows_per_file=100_000):
+        if layout not in self.layouts:
+            raise ValueError(f"Unknown layout: {layout}")
+        self.path = path
+        self.layout = layout
+        self.rows_per_file = rows_per_file
+        self.buffer = []
+        self.buffered_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def append(self, params, metrics):
+        """Add the metric columns of a run, as collected by MetricsCollector, with its parameters.
+
+        Metrics holding an array per step, such as histograms, are not stored.
+        """
+        metrics = scalar_columns(metrics)
+        steps = len(next(iter(metrics.values()), []))
+        columns = {}
+        for name, type in parameter_types.items():
+            value = params.get(name)
+            if name in repr_parameters and value is not None:
+                value = repr(value)
+            columns[name] = pa.array([value] * steps, type=type)
+        # Runs recording every k-th step hold rows k steps apart
+        columns["step"] = pa.array(np.arange(steps) * (params.get("record_every") or 1), pa.int64())
+
+        if self.layout == "wide":
+            for column, values in metrics.items():
+                columns[column] = pa.array(values).cast(metric_types.get(column, pa.float64()))
+            table = pa.table(columns)
+        else:
+            table = pa.concat_tables([
+                pa.table({
+                    **columns,
+                    "metric": pa.array([column] * steps, pa.string()),
+                    "value": pa.array(values).cast(pa.float64()),
+                })
+                for column, values in metrics.items()
+            ])
+
+        self.buffer.append(table)
+        self.buffered_rows += table.num_rows
+        if self.buffered_rows >= self.rows_per_file:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered runs as a new file of the dataset."""
+        if not self.buffer:
+            return
+        ds.write_dataset(
+            pa.concat_tables(self.buffer),
+            self.path,
+            format="parquet",
+            partitioning=["stage"],
+            partitioning_flavor="hive",
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        self.buffer = []
+        self.buffered_rows = 0
+
+    def dataset(self):
+        return ds.dataset(self.path, format="parquet", partitioning="hive")
+
+    def read(self, columns=None, **equals):
+        """Returns the stored rows as a DataFrame.
+
+        Keyword arguments select rows whose column equals the value, such as
+        stage="Reputation" or child_cost=1, and are pushed down to the Parquet reader.
+        """
+        condition = None
+        for name, value in equals.items():
+            clause = pc.field(name) == value
+            condition = clause if condition is None else condition & clause
+        return self.dataset().to_table(columns=columns, filter=condition).to_pandas()
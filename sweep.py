@@ -0,0 +1,325 @@
+"""
+Parameter sweeps over Model, run across a pool of worker processes.
+"""
+import argparse
+import inspect
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from functools import partial
+
+import pandas as pd
+
+from metrics import MetricsSnapshot
+from model import Model, metrics_filename
+
+
+def parameter_grid(**values):
+    """Returns the keyword arguments of Model for every combination of the given values.
+
+    Each argument may be a single value or a list of values to sweep over.
+    """
+    values = {name: value if isinstance(value, (list, tuple, range)) else [value] for name, value in values.items()}
+    return [dict(zip(values, combination)) for combination in itertools.product(*values.values())]
+
+
+def model_arguments(params):
+    """Returns every keyword argument of Model for a parameter point, defaults included."""
+    arguments = inspect.signature(Model).bind(**params)
+    arguments.apply_defaults()
+    return arguments.arguments
+
+
+def run_point(params, steps):
+    """Run a single Model for a number of steps, returning its parameters and metric columns."""
+    model = Model(**params)
+    model.run(steps)
+    # Views on the metric columns only pickle the collected rows
+    return params, model.datacollector.model_vars
+
+
+def run_sweep(grid, steps=20, processes=None, chunksize=None, cache=None):
+    """Run every parameter point of the grid, yielding (params, metrics) in grid order.
+
+    Points are sent to the workers in chunks, and metrics come back as a dict of
+    NumPy columns rather than a DataFrame. With processes=1 the sweep runs in
+    this process. Given a RunCache, points already in it are read back instead
+    of being run, and newly finished points are added to it.
+    """
+    if cache is None:
+        yield from run_points(grid, steps, processes, chunksize)
+        return
+
+    cached = [(model_arguments(params), steps) in cache for params in grid]
+    missing = [params for params, hit in zip(grid, cached) if not hit]
+    results = run_points(missing, steps, processes, chunksize)
+    for params, hit in zip(grid, cached):
+        if hit:
+            yield params, cache.get(model_arguments(params), steps)
+        else:
+            params, metrics = next(results)
+            cache.put(model_arguments(params), steps, metrics)
+            yield params, metrics
+
+
+def run_points(grid, steps, processes, chunksize):
+    """Run every parameter point of the grid, yielding (params, metrics) in grid order."""
+    if not grid:
+        return
+    if processes == 1:
+        yield from (run_point(params, steps) for params in grid)
+        return
+
+    processes = processes or os.cpu_count()
+    if chunksize is None:
+        # A few chunks per worker balances the load without much dispatch overhead
+        chunksize = max(1, len(grid) // (processes * 4))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        yield from executor.map(partial(run_point, steps=steps), grid, chunksize=chunksize)
+
+
+def cooperation(metrics):
+    """Share of cooperating agents at the last step of a run, 0 once extinct."""
+    total = metrics["All Agents"][-1]
+    return metrics["Cooperating Agents"][-1] / total if total else 0.0
+
+
+def point_params(base, axes, point):
+    """Returns the Model arguments of a point of an adaptive sweep.
+
+    Axes name Model arguments, or a payoff such as payoffs.DC for the payoff
+    of defecting against a cooperator.
+    """
+    params = dict(base)
+    for name, value in zip(axes, point):
+        if name.startswith("payoffs."):
+            moves = tuple(name.removeprefix("payoffs."))
+            params["payoffs"] = {**(params.get("payoffs") or Model.payoff), moves: value}
+        else:
+            params[name] = value
+    return params
+
+
+def adaptive_sweep(
+    base, axes, seeds=10, steps=20, budget=10_000, coarse=5, tolerance=0.25, min_width=0.001, outcome=cooperation,
+    processes=None, chunksize=None, cache=None,
+):
+    """Map the mean outcome of runs over a box of parameters, refining it only where the outcome changes.
+
+    axes maps each swept argument to its (low, high) range, and base holds the
+    other arguments of Model. The box starts as a grid of coarse points per axis,
+    each point run with seeds seeds. A cell whose corners' mean outcomes differ by
+    more than tolerance is split in two along every axis, the widest and most
+    disagreeing cells first, until no cell disagrees or the next split would
+    take more than budget runs in total. Cells are not split below min_width,
+    in units of the axes' ranges, so that a true jump in the outcome is not
+    bisected down to float resolution. The coarse grid is always run.
+
+    Returns a DataFrame with the coordinates and mean outcome of every point run.
+    """
+    names = list(axes)
+    # Mean outcome of each point, and of each distinct parameter value, which is only run once
+    outcomes = {}
+    results = {}
+
+    def value(point):
+        return tuple(low + float(u) * (high - low) for u, (low, high) in zip(point, axes.values()))
+
+    def run(points):
+        values = [point for point in dict.fromkeys(map(value, points)) if point not in results]
+        grid = [{**point_params(base, names, point), "seed": seed} for point in values for seed in range(seeds)]
+        totals = dict.fromkeys(values, 0.0)
+        for i, (params, metrics) in enumerate(run_sweep(grid, steps, processes, chunksize, cache)):
+            totals[values[i // seeds]] += outcome(metrics)
+        results.update((point, total / seeds) for point, total in totals.items())
+        outcomes.update((point, results[value(point)]) for point in points)
+
+    def corners(cell):
+        return list(itertools.product(*zip(*cell)))
+
+    def spread(cell):
+        values = [outcomes[corner] for corner in corners(cell)]
+        return max(values) - min(values)
+
+    # Cells are the lower and upper corners of a box, in units of the axes' ranges
+    width = Fraction(1, coarse - 1)
+    cells = [
+        (lower, tuple(u + width for u in lower))
+        for lower in itertools.product(*[[i * width for i in range(coarse - 1)]] * len(names))
+    ]
+    run([corner for cell in cells for corner in corners(cell)])
+
+    while True:
+        disagreeing = sorted(
+            (cell for cell in cells if spread(cell) > tolerance and (cell[1][0] - cell[0][0]) / 2 >= min_width),
+            key=lambda cell: (cell[0][0] - cell[1][0], -spread(cell)),
+        )
+        split, new_points = [], set()
+        for lower, upper in disagreeing:
+            middle = tuple((l + u) / 2 for l, u in zip(lower, upper))
+            children = [tuple(zip(*halves)) for halves in itertools.product(*zip(zip(lower, middle), zip(middle, upper)))]
+            points = {corner for child in children for corner in corners(child) if corner not in outcomes}
+            if len(results.keys() | {value(point) for point in new_points | points}) * seeds > budget:
+                break
+            split.append(((lower, upper), children))
+            new_points |= points
+        if not split:
+            break
+        run(sorted(new_points))
+        for cell, children in split:
+            cells.remove(cell)
+            cells.extend(children)
+
+    return pd.DataFrame(
+        [(*point, result, seeds) for point, result in sorted(results.items())],
+        columns=[*names, "outcome", "runs"],
+    )
+
+
+def write_csv(params, metrics):
+    """Write the metrics of a run to the file Model.filename would name for it."""
+    arguments = model_arguments(params)
+    filename = metrics_filename(
+        arguments["seed"],
+        arguments["initial_pop"],
+        arguments["activation_order"],
+        arguments["payoffs"],
+        arguments["distribution"],
+        arguments["stage"],
+        arguments["child_cost"],
+    )
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    # Points of a sweep keep every row they record, so the first one is step 0
+    rows = len(next(iter(metrics.values()), []))
+    data = MetricsSnapshot(None, rows, metrics, every=arguments["record_every"]).get_model_vars_dataframe()
+    if not data.empty:
+        data.to_csv(filename)
+
+
+def graph_spec(text):
+    """Parse a command line graph spec such as small-world:1000,8,0.1 into a tuple."""
+    kind, _, arguments = text.partition(":")
+    return (kind, *(number(argument) for argument in arguments.split(",") if argument))
+
+
+def axis_spec(text):
+    """Parse a command line axis such as child_cost=0.25:4 into its name and range."""
+    name, _, bounds = text.partition("=")
+    low, _, high = bounds.partition(":")
+    return name, (float(low), float(high))
+
+
+def number(text):
+    """Parse a command line number, keeping whole numbers as int like the defaults of Model."""
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of the greenbeards model.")
+    parser.add_argument("--stage", nargs="+", default=Model.simulation_stages, choices=Model.simulation_stages)
+    parser.add_argument("--initial-pop", nargs="+", type=int, default=[100])
+    parser.add_argument("--activation-order", nargs="+", default=["Simultaneous"], choices=Model.activation_regimes)
+    parser.add_argument("--distribution", nargs="+", type=number, default=[0.5])
+    parser.add_argument("--child-cost", nargs="+", type=number, default=[1])
+    parser.add_argument("--engine", nargs="+", default=["Agents"], choices=Model.engines)
+    parser.add_argument("--carrying-capacity", nargs="+", type=int, default=[None])
+    parser.add_argument("--grid-size", nargs="+", type=int, default=[50], help="side of the grid of the Grid engine")
+    parser.add_argument(
+        "--graph", nargs="+", type=graph_spec, default=[None],
+        help="graphs of the Network engine, such as small-world:1000,8,0.1, scale-free:1000,4 or lattice:30,30",
+    )
+    parser.add_argument(
+        "--stop-on-fixation", action="store_true", help="end runs once extinct or a single genotype has fixed"
+    )
+    parser.add_argument("--timings", action="store_true", help="record the time of each phase of a step as metrics")
+    parser.add_argument(
+        "--common-random-numbers", action="store_true",
+        help="draw pairings, offspring and initial traits from streams shared by every point with the same seed",
+    )
+    parser.add_argument("--record-every", type=int, default=1, help="record the metrics of every k-th step only")
+    parser.add_argument("--seeds", type=int, default=100, help="number of seeds per parameter point")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, all cores by default")
+    parser.add_argument("--chunksize", type=int, default=None)
+    parser.add_argument("--cache", default=None, help="directory of the run cache, runs are not cached by default")
+    parser.add_argument("--store", default=None, help="Parquet dataset to append runs to, instead of one CSV per run")
+    parser.add_argument("--layout", default="wide", choices=["wide", "long"], help="metric layout of the Parquet dataset")
+    parser.add_argument(
+        "--adaptive", nargs="+", type=axis_spec, default=None, metavar="AXIS=LOW:HIGH",
+        help="map the cooperation outcome over these ranges, such as child_cost=0.25:4 or payoffs.DC=3:8, "
+             "refining only where it changes, instead of running every seed of the grid",
+    )
+    parser.add_argument("--budget", type=int, default=10_000, help="most runs of each adaptive map")
+    parser.add_argument("--coarse", type=int, default=5, help="points per axis of the initial adaptive grid")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="outcome difference that gets a cell refined")
+    parser.add_argument(
+        "--min-width", type=float, default=0.001, help="narrowest cell split, as a share of each adaptive range"
+    )
+    parser.add_argument("--output", default="adaptive.csv", help="CSV file of the adaptive maps")
+    args = parser.parse_args()
+
+    if args.adaptive is not None:
+        from cache import RunCache
+
+        cache = None if args.cache is None else RunCache(args.cache)
+        maps = []
+        bases = parameter_grid(
+            stage=args.stage,
+            initial_pop=args.initial_pop,
+            activation_order=args.activation_order,
+            distribution=args.distribution,
+            child_cost=args.child_cost,
+            engine=args.engine,
+            carrying_capacity=args.carrying_capacity,
+            grid_size=args.grid_size,
+            graph=args.graph,
+            stop_on_fixation=args.stop_on_fixation,
+            common_random_numbers=args.common_random_numbers,
+        )
+        for base in bases:
+            outcomes = adaptive_sweep(
+                base, dict(args.adaptive), args.seeds, args.steps, args.budget, args.coarse, args.tolerance,
+                args.min_width, processes=args.processes, chunksize=args.chunksize, cache=cache,
+            )
+            for name, value in base.items():
+                if name not in outcomes:
+                    outcomes[name] = repr(value) if name == "graph" else value
+            maps.append(outcomes)
+            print(f"{base}: {outcomes['runs'].sum()} runs")
+        pd.concat(maps, ignore_index=True).to_csv(args.output, index=False)
+        sys.exit()
+
+    grid = parameter_grid(
+        stage=args.stage,
+        initial_pop=args.initial_pop,
+        activation_order=args.activation_order,
+        distribution=args.distribution,
+        child_cost=args.child_cost,
+        engine=args.engine,
+        carrying_capacity=args.carrying_capacity,
+        grid_size=args.grid_size,
+        graph=args.graph,
+        stop_on_fixation=args.stop_on_fixation,
+        timings=args.timings,
+        common_random_numbers=args.common_random_numbers,
+        record_every=args.record_every,
+        seed=range(args.seeds),
+    )
+    cache = None
+    if args.cache is not None:
+        from cache import RunCache
+
+        cache = RunCache(args.cache)
+    results = run_sweep(grid, args.steps, args.processes, args.chunksize, cache)
+    if args.store is None:
+        for params, metrics in results:
+            write_csv(params, metrics)
+    else:
+        from storage import ResultStore
+
+        with ResultStore(args.store, layout=args.layout) as store:
+            for params, metrics in results:
+                store.append(model_arguments(params), metrics)